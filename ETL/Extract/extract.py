@@ -10,10 +10,12 @@ root_directory = os.path.abspath(os.path.join(current_script_directory, os.pardi
 # Add the root directory to sys.path
 sys.path.append(root_directory)
 
-from PyUtilities import read_config_file, mkdir_if_not_exists
+from PyUtilities import read_config_file, mkdir_if_not_exists, scan_files, get_relative_path, read_ndjson, write_ndjson, index_ndjson, read_ndjson_record, read_manifest, write_manifest, diff_manifest, hash_content, MANIFEST_FILE_NAME, PENDING_MANIFEST_FILE_NAME, try_read_nifti_header
 
 from pathlib import Path
 import pandas as pd
+import concurrent.futures
+import itertools
 import logging
 import json
 
@@ -28,6 +30,9 @@ def extract_sidecar_data()-> json:
     Function to extract data from all sidecar files from BIDS folder.
 
     Returns: data (pandas DataFrame): Extracted data from BIDS sidecar files.
+    The sidecars are keyed by their path relative to the BIDS directory.
+    If the extraction_format is 'ndjson', a generator of (relative path, data) tuples
+    reading the stored NDJSON file lazily is returned instead.
     """ 
     ## CHECKS
     # Check if config file is read successfully
@@ -53,45 +58,181 @@ def extract_sidecar_data()-> json:
         workflow_logger.error(f"BIDS path does not exist: {bids_path}")
         exit()
     # Get all sidecar files finding *_sidecar.json
-    sidecar_files = Path(bids_path).rglob('*_sidecar.json')
-
-    # Extract data from all sidecar json files
-    data = combine_json_files(sidecar_files)
-        
-    # check if data is empty
-    if data is None or len(data) == 0:
-        workflow_logger.error("Extracted data is empty, no data will be processed")
+    sidecar_files = scan_files(bids_path, '_sidecar.json', CONFIG.get('extraction_scan_workers', 1))
+    # check if sidecar files are found
+    if len(sidecar_files) == 0:
+        workflow_logger.error(f"No sidecar files found in {bids_path}, no data will be processed")
         exit()
 
+    # Compare the sidecar files with the manifest of the last successful run
+    manifest = None
+    file_id_manifest = None
+    previous_manifest = None
+    deleted_sidecars = {}
+    if CONFIG.get('incremental_extraction', False):
+        previous_manifest = read_manifest(os.path.join(CONFIG['extraction_path'], MANIFEST_FILE_NAME))
+        sidecar_files, deleted_sidecars, manifest = diff_manifest(sidecar_files, bids_path, previous_manifest)
+    elif CONFIG.get('sync_deletions', False):
+        # Record the file_ids of all sidecars in a manifest, which is not stored
+        file_id_manifest = {get_relative_path(file_path, bids_path): {} for file_path in sidecar_files}
+
+    # Extract data from all (new or modified) sidecar json files
+    num_workers = CONFIG.get('extraction_parse_workers', 1)
+    if CONFIG.get('extraction_format', 'json') == 'ndjson':
+        # Stream the sidecars one by one into the NDJSON file, the data is never held in memory as a whole
+        num_sidecars = store_data_ndjson(iter_sidecar_elements(sidecar_files, manifest or file_id_manifest, previous_manifest, num_workers))
+        data = read_extracted_data()
+    else:
+        data = combine_json_files(sidecar_files, manifest or file_id_manifest, previous_manifest, num_workers)
+        # check if data is empty
+        if data is None or len(data) == 0:
+            workflow_logger.error("Extracted data is empty, no data will be processed")
+            exit()
+        num_sidecars = len(data['sidecardata'])
+    if num_sidecars == 0 and len(deleted_sidecars) == 0:
+        workflow_logger.info("No sidecar files have been added, modified or deleted since the last run.")
+
     ## Store data
-    store_data(data)
-    workflow_logger.debug(f"Data stored successfully, path: {CONFIG['extraction_path']}/extracted_data.json")
-    workflow_logger.info(f"Data extracted:\n{data}")
+    if not isinstance(data, dict):
+        workflow_logger.debug(f"Data stored successfully, path: {get_extracted_data_path()}")
+        workflow_logger.info(f"Data extracted: {num_sidecars} sidecar files")
+    else:
+        store_data(data)
+        workflow_logger.debug(f"Data stored successfully, path: {CONFIG['extraction_path']}/extracted_data.json")
+        workflow_logger.info(f"Data extracted:\n{data}")
+    if manifest is not None:
+        # the rows of deleted sidecars are removed by the load with sync_deletions (see store_extracted_file_ids)
+        workflow_logger.info(f"Sidecar files deleted since the last run: {len(deleted_sidecars)}")
+        write_manifest(os.path.join(CONFIG['extraction_path'], PENDING_MANIFEST_FILE_NAME), manifest)
+    if CONFIG.get('sync_deletions', False):
+        store_extracted_file_ids(manifest if manifest is not None else file_id_manifest)
     return data
 
-def combine_json_files(json_files:list)-> json:
+def combine_json_files(json_files:list, manifest:dict=None, previous_manifest:dict=None, num_workers:int=1)-> json:
     """
     Combines data from multiple JSON files into a single dictionary.
-    The dictionary has filenames as keys and the file data as values.
+    The dictionary has the file paths relative to the BIDS directory as keys and the file data as values.
     Also includes a 'sidecardata' key with the dict as values.
+    See iter_sidecar_elements for the handling of the manifests and workers.
 
     :param json_files: List of paths to JSON files
+    :param manifest: Manifest of the current run, keyed by the path relative to the BIDS directory
+    :param previous_manifest: Manifest of the last successful run
+    :param num_workers: Number of files read and parsed concurrently
     :return: Dictionary containing data from all JSON files
     """
-    sidecarelements = {}
-    for file_path in json_files:
-        filename = os.path.basename(file_path)
-        try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-                sidecarelements[filename] = data
-            
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
-
+    sidecarelements = dict(iter_sidecar_elements(json_files, manifest, previous_manifest, num_workers))
     combined_data = {'sidecardata': sidecarelements}
     return combined_data
 
+def iter_sidecar_elements(json_files:list, manifest:dict=None, previous_manifest:dict=None, num_workers:int=1):
+    """
+    Reads the JSON files lazily and yields one (relative path, data) element per file.
+    The relative path to the BIDS directory is used as key, so files with the same name
+    in different directories are kept apart.
+    If a manifest is given, the content hash and file_id of every read file is recorded in it,
+    and files whose content hash equals the one in the previous manifest are left out.
+    The files are read by num_workers threads, the elements keep the order of json_files.
+
+    :param json_files: List of paths to JSON files
+    :param manifest: Manifest of the current run, keyed by the path relative to the BIDS directory
+    :param previous_manifest: Manifest of the last successful run
+    :param num_workers: Number of files read and parsed concurrently
+    :return: Generator of (relative path, data) tuples
+    """
+    for file_path, data, content_hash, error in iter_read_sidecar_files(json_files, num_workers):
+        rel_path = get_relative_path(file_path, CONFIG['bids_dir_path'])
+        if error is not None:
+            print(f"Error reading {file_path}: {error}")
+            # forget the file attributes, so the file is read again in the next run
+            if manifest is not None:
+                manifest[rel_path] = {}
+            continue
+
+        if manifest is not None:
+            manifest[rel_path]['hash'] = content_hash
+            manifest[rel_path]['file_id'] = get_sidecar_file_id(data)
+            # only the attributes changed (e.g. touch or copy), the content is the same
+            previous_entry = previous_manifest.get(rel_path) if previous_manifest else None
+            if previous_entry is not None and previous_entry.get('hash') == content_hash:
+                continue
+        yield rel_path, data
+
+def iter_read_sidecar_files(json_files:list, num_workers:int=1):
+    """
+    Reads the sidecar files with num_workers threads, in the order of json_files.
+    Only a bounded number of files is read ahead, so the memory use does not grow with the number of files.
+
+    :param json_files: List of paths to JSON files
+    :param num_workers: Number of files read and parsed concurrently
+    :return: Generator of the try_read_sidecar_file results
+    """
+    if num_workers <= 1:
+        yield from map(try_read_sidecar_file, json_files)
+        return
+    json_files = iter(json_files)
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        while True:
+            batch = list(itertools.islice(json_files, num_workers * 16))
+            if not batch:
+                break
+            yield from executor.map(try_read_sidecar_file, batch)
+
+def read_sidecar_file(file_path) -> tuple:
+    """
+    Reads a sidecar file once and returns its parsed content and content hash.
+
+    :param file_path: Path to the sidecar JSON file
+    :return: Tuple of the parsed JSON data and the sha256 hash of the file content
+    """
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    return json.loads(content), hash_content(content)
+
+def try_read_sidecar_file(file_path) -> tuple:
+    """
+    Reads a sidecar file like read_sidecar_file, but returns the error instead of raising it,
+    so that one unreadable file does not stop a worker pool.
+
+    :param file_path: Path to the sidecar JSON file
+    :return: Tuple of the file path, the parsed JSON data, the content hash and the error (None on success)
+    """
+    try:
+        data, content_hash = read_sidecar_file(file_path)
+    except Exception as e:
+        return file_path, None, None, e
+    if CONFIG.get('read_nifti_headers', False):
+        add_nifti_header_values(data)
+    return file_path, data, content_hash, None
+
+def add_nifti_header_values(data:json) -> None:
+    """
+    Adds the image geometry read from the NIfTI header of the sidecar's image to its bids element.
+    Only the header is read, the volume is not decompressed. Sidecars of other files are left unchanged.
+
+    :param data: Parsed sidecar data, changed in place
+    :return: None
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('bids'), dict) or not isinstance(data.get('files'), dict):
+        return None
+    file_path = str(data['files'].get('file_path', ''))
+    if not file_path.endswith(('.nii', '.nii.gz')):
+        return None
+    header_values = try_read_nifti_header(os.path.join(CONFIG['bids_dir_path'], file_path.lstrip('/')))
+    if header_values is not None:
+        data['bids'].update(header_values)
+
+def get_sidecar_file_id(data:json):
+    """
+    Returns the file_id of a sidecar, None if the sidecar has no files element.
+
+    :param data: Parsed sidecar data
+    :return: file_id or None
+    """
+    if isinstance(data, dict) and isinstance(data.get('files'), dict):
+        return data['files'].get('file_id')
+    return None
+
 def store_data(data:json) -> None:
     """
     Stores the extracted data into a JSON file.
@@ -111,6 +252,73 @@ def store_data(data:json) -> None:
     with open(data_file, 'w') as f:
         json.dump(data, f)
 
+def get_extracted_data_path() -> str:
+    """
+    Returns the path of the NDJSON extraction file.
+
+    :return: Path to extracted_data.ndjson in the extraction path
+    """
+    return os.path.join(CONFIG['extraction_path'], 'extracted_data.ndjson')
+
+def store_data_ndjson(elements, index:dict=None) -> int:
+    """
+    Stores the extracted data into a NDJSON file, one record per sidecar file.
+    The elements are consumed lazily.
+
+    :param elements: Iterable of (relative path, data) tuples
+    :param index: Optional dictionary, filled with the byte offset of every record keyed by its relative path
+    :return: Number of stored sidecar records
+    """
+    mkdir_if_not_exists(os.path.join(CONFIG['extraction_path']))
+    records = ({'sidecar': rel_path, 'sidecardata': data} for rel_path, data in elements)
+    return write_ndjson(get_extracted_data_path(), records, index, 'sidecar')
+
+def read_extracted_data():
+    """
+    Reads the NDJSON extraction file lazily.
+
+    :return: Generator of (relative path, data) tuples
+    """
+    for record in read_ndjson(get_extracted_data_path()):
+        yield record['sidecar'], record['sidecardata']
+
+def index_extracted_data() -> dict:
+    """
+    Builds the index of the NDJSON extraction file, to look up single sidecars without loading the file.
+
+    :return: Dictionary with the byte offset of every record keyed by the relative sidecar path
+    """
+    return index_ndjson(get_extracted_data_path(), 'sidecar')
+
+def read_extracted_sidecar(index:dict, rel_path:str):
+    """
+    Reads the data of one sidecar from the NDJSON extraction file.
+
+    :param index: Index built by index_extracted_data or store_data_ndjson
+    :param rel_path: Sidecar path relative to the BIDS directory
+    :return: Sidecar data or None if the sidecar was not extracted
+    """
+    offset = index.get(rel_path)
+    if offset is None:
+        return None
+    with open(get_extracted_data_path(), 'rb') as f:
+        return read_ndjson_record(f, offset)['sidecardata']
+
+def store_extracted_file_ids(manifest:dict) -> None:
+    """
+    Stores the file_ids of all current sidecars into a JSON file, used to delete the rows of removed files
+    from the database. The set is marked incomplete if a sidecar could not be read, since its file_id is unknown.
+
+    :param manifest: Manifest of the current run, with the file_id of every read sidecar
+    :return: None
+    """
+    complete = all('hash' in entry for entry in manifest.values())
+    file_ids = sorted({entry['file_id'] for entry in manifest.values() if entry.get('file_id') is not None})
+    data_file = os.path.join(CONFIG['extraction_path'], 'extracted_file_ids.json')
+    with open(data_file, 'w') as f:
+        json.dump({'complete': complete, 'file_ids': file_ids}, f)
+    workflow_logger.debug(f"Extracted file_ids stored successfully, path: {data_file}")
+
 # Extract program
 if __name__ == "__main__":
     """
@@ -118,5 +326,6 @@ if __name__ == "__main__":
     It calls the extract_sidecar_data function to extract data from BIDS sidecar files.
     """
     extracted_data = extract_sidecar_data()
-    print(extracted_data)
+    if isinstance(extracted_data, dict):
+        print(extracted_data)
     workflow_logger.info("Data extracted successfully.")
@@ -11,13 +11,18 @@ root_directory = os.path.abspath(os.path.join(current_script_directory, os.pardi
 sys.path.append(root_directory)
 
 from PyUtilities.setupFunctions import read_config_file
-from PyUtilities.databaseFunctions import create_database, execute_sql_script, data_check
+from PyUtilities.databaseFunctions import create_database, execute_sql_script, insert_rows_batched, delete_orphaned_files, begin_change_run, data_check, set_connection_profile, connection_profile, DatabaseSession
+from PyUtilities.read_write import read_ndjson
 import logging
+import json
 
 CONFIG_FILE_PATH = 'config.json'
 CONFIG = read_config_file(CONFIG_FILE_PATH)
 # Configure logger
 workflow_logger = logging.getLogger('workflow_logger')
+# Configure the SQLite connections (a missing config file is reported by the steps)
+if CONFIG is not None:
+    set_connection_profile(CONFIG.get('db_profile', 'safe'), CONFIG.get('db_pragmas'))
 
 # Database setup Function
 def database_setup():
@@ -45,9 +50,11 @@ def database_setup():
     ## DATABASE CREATION
     create_database(CONFIG['db_path'], CONFIG['db_schema'])
 
-def load_sidecar_data()->None:
+def load_sidecar_data()->bool:
     """
     Function to load data into the destination database.
+    Returns True if the data was loaded successfully, the manifest of an incremental run
+    must only be committed then.
     """
     ## CHECKS
     # Check if config file is read successfully
@@ -58,8 +65,13 @@ def load_sidecar_data()->None:
     if CONFIG['skip_loading']:
         workflow_logger.info("Loading is skipped as per config file.")
         exit()
+    if CONFIG.get('load_upsert', False) and CONFIG.get('load_method', 'script') != 'batched':
+        workflow_logger.warning("load_upsert requires the 'batched' load_method, existing rows are not updated.")
     # Check if CONFIG extraction_path: filepath exists
-    sqlfile = os.path.join(CONFIG['extraction_path'], 'insertSideCarData.sql')
+    if CONFIG.get('load_method', 'script') == 'batched':
+        sqlfile = os.path.join(CONFIG['extraction_path'], 'transformedSideCarData.ndjson')
+    else:
+        sqlfile = os.path.join(CONFIG['extraction_path'], 'insertSideCarData.sql')
     if not os.path.exists(sqlfile):
         workflow_logger.error(f"Data path does not exist: {sqlfile}")
         exit()
@@ -70,29 +82,102 @@ def load_sidecar_data()->None:
 
     ## DATA LOADING
     workflow_logger.info("Data loading started.")
-    load_siglefile_data_into_database(sqlfile,CONFIG['db_path'])
+    # use the bulk load connection profile while loading, all steps share one connection and
+    # the load is committed only if it succeeded
+    with connection_profile(CONFIG.get('db_load_profile', 'bulk'), CONFIG.get('db_pragmas')), \
+         DatabaseSession(CONFIG['db_path'], autocommit=False) as session:
+        # the changes of this run are recorded with a new run counter in the change_log table
+        run_id = begin_change_run(CONFIG['db_path'])
+        if run_id is not None:
+          workflow_logger.debug(f"Change tracking run: {run_id}")
+        if CONFIG.get('load_method', 'script') == 'batched':
+            loaded = load_rows_into_database(sqlfile, CONFIG['db_path'])
+        else:
+            loaded = load_siglefile_data_into_database(sqlfile,CONFIG['db_path'])
+        # remove the rows of files whose sidecar was deleted
+        if loaded and CONFIG.get('sync_deletions', False):
+            loaded = delete_removed_files_from_database(os.path.join(CONFIG['extraction_path'], 'extracted_file_ids.json'), CONFIG['db_path'])
+        if not loaded:
+            session.connection().rollback()
+    if not loaded:
+        workflow_logger.error("Data loading failed.")
+        return False
     workflow_logger.info("Data loaded into the database.")
 
     ## CHECK IF DATA LOADED
     data_check(CONFIG['db_path'])
+    return True
 
 # Load data into database Function
-def load_siglefile_data_into_database(sql_file:str,db_path:str)->None:
+def load_siglefile_data_into_database(sql_file:str,db_path:str)->bool:
     """
     Function to load the data into the destination database.
     Check if the sqlite database is created.
     Check if sql files are provided, in the data folder.
     Execute the sql files to load the data into the database.
+    Returns True if the data was loaded.
     """
 
-    if os.path.isfile(db_path):
-      # Execute the SQL file
-      with open(sql_file, 'r') as file:
-        sql = file.read()
-        # Execute the SQL
-        execute_sql_script(sql, db_path)
+    if not os.path.isfile(db_path):
+      return False
+    # Execute the SQL file
+    with open(sql_file, 'r') as file:
+      sql = file.read()
+      # Execute the SQL
+      result = execute_sql_script(sql, db_path)
+    if isinstance(result, Exception):
+      workflow_logger.error(f"Data could not be loaded into SQLite Database: {result}")
+      return False
+
+    workflow_logger.debug("Data loaded into SQLite Database")
+    return True
+
+# Load transformed rows into database Function
+def load_rows_into_database(rows_file:str,db_path:str)->bool:
+    """
+    Function to load the transformed table rows into the destination database.
+    The rows are streamed from the NDJSON file and inserted with bound parameters
+    in batches per table, inside one transaction.
+    If load_upsert is set in the config file, existing rows whose values changed are updated.
+    Returns True if the data was loaded.
+    """
+
+    if not os.path.isfile(db_path):
+      return False
+    rows = ((record['table'], record['row']) for record in read_ndjson(rows_file))
+    inserted = insert_rows_batched(rows, db_path, CONFIG.get('load_batch_size', 5000), CONFIG.get('load_upsert', False))
+    if inserted is None:
+      workflow_logger.error("Data could not be loaded into SQLite Database")
+      return False
+
+    workflow_logger.debug(f"Data loaded into SQLite Database: {inserted}")
+    return True
+
+# Delete removed files from database Function
+def delete_removed_files_from_database(file_ids_file:str,db_path:str)->bool:
+    """
+    Function to delete the rows of files, whose sidecar is no longer in the BIDS directory, from the destination database.
+    The file_ids of the current sidecars are read from the file stored by the extraction.
+    Nothing is deleted if the extraction could not read all sidecars.
+    Returns False if the deletion failed, skipping it is no failure.
+    """
 
-      workflow_logger.debug("Data loaded into SQLite Database")
+    if not os.path.exists(file_ids_file):
+      workflow_logger.warning(f"Extracted file_ids not found, deleted files are not synchronized: {file_ids_file}")
+      return True
+    with open(file_ids_file, 'r') as f:
+      extracted = json.load(f)
+    if not extracted['complete']:
+      workflow_logger.warning("Not all sidecars could be extracted, deleted files are not synchronized.")
+      return True
+
+    deleted = delete_orphaned_files(db_path, extracted['file_ids'])
+    if deleted is None:
+      workflow_logger.error("Deleted files could not be removed from SQLite Database")
+      return False
+
+    workflow_logger.info(f"Deleted files removed from SQLite Database: {deleted}")
+    return True
 
 if __name__ == "__main__":
     # Set up logger
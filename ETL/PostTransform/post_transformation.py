@@ -10,19 +10,26 @@ root_directory = os.path.abspath(os.path.join(current_script_directory, os.pardi
 # Add the root directory to sys.path
 sys.path.append(root_directory)
 
-from PyUtilities import read_config_file, mkdir_if_not_exists
+from PyUtilities import read_config_file, mkdir_if_not_exists, get_sidecar_path, index_ndjson, read_ndjson_record
+from PyUtilities.read_write import read_json_to_dict, write_json_atomic
 
 from pathlib import Path
 import pandas as pd
+import concurrent.futures
+import itertools
 import logging
 import json
-from sqlalchemy import create_engine 
+import sqlite3
+from PyUtilities.databaseFunctions import create_database_engine, open_connection, commit_connection, close_connection, update_column_values, read_change_log, clear_change_log, set_connection_profile, DatabaseSession
 
 # Configure logger
 workflow_logger = logging.getLogger('workflow_logger')
 
 CONFIG_FILE_PATH = 'config.json'
 CONFIG = read_config_file(CONFIG_FILE_PATH)
+# Configure the SQLite connections (a missing config file is reported by the steps)
+if CONFIG is not None:
+    set_connection_profile(CONFIG.get('db_profile', 'safe'), CONFIG.get('db_pragmas'))
 
 def clean_image_tables() -> None:
     """
@@ -48,25 +55,50 @@ def clean_image_tables() -> None:
         workflow_logger.error(f"Extracted data file path does not exist: {CONFIG['extraction_path']}")
         exit()
     # Check if the extracted data JSON file exists
-    if not os.path.exists(os.path.join(CONFIG['extraction_path'],'extracted_data.json')):
-        workflow_logger.error(f"Extracted data JSON file does not exist: {CONFIG['extraction_path'] + 'extracted_data.json'}")
+    if not os.path.exists(get_extracted_data_file()):
+        workflow_logger.error(f"Extracted data JSON file does not exist: {get_extracted_data_file()}")
         exit()
 
     ## CLEAN IMAGE TABLES
-    # Populate Subject IDs in files table
-    update_subject_ids()
+    # the updates share one connection
+    with DatabaseSession(CONFIG['db_path']):
+        # Populate Subject IDs in files table
+        if CONFIG.get('subject_id_method', 'merge') == 'sql':
+            update_subject_ids_sql()
+        else:
+            update_subject_ids()
+
+        # Populate the Transformation_id in the files table
+        update_transformation_id()
+
+def get_extracted_data_file() -> str:
+    """
+    Function to get the path of the extracted data file, according to the extraction_format of the config file.
+
+    return: path to extracted_data.json or extracted_data.ndjson
+    """
+    if CONFIG.get('extraction_format', 'json') == 'ndjson':
+        return os.path.join(CONFIG['extraction_path'], 'extracted_data.ndjson')
+    return os.path.join(CONFIG['extraction_path'], 'extracted_data.json')
 
-    # Populate the Transformation_id in the files table
-    update_transformation_id()
+def get_bids_subject_id(file_path:str) -> str:
+    """
+    Function to get the BIDS subject ID (without "sub-", upper case) from the file name of a file path.
+
+    return: BIDS subject ID
+    """
+    return file_path.split("/")[-1].split("_")[0].replace("sub-", "").strip().upper()
 
 def update_subject_ids() -> None:
     """
     Function to update the Subject IDs in the files table of SQLite DB.
+    The BIDS subject IDs of the files are resolved with one hash lookup in the subjects table,
+    only the changed subject_id values are written to the files table.
 
     return: None
     """  
     # Get the Subjects table from the SQLite DB
-    engine = create_engine("sqlite:///"+CONFIG["db_path"])  
+    engine = create_database_engine(CONFIG["db_path"])  
     with engine.connect() as conn, conn.begin():
         subjects = pd.read_sql("SELECT * FROM subjects", conn)
 
@@ -81,31 +113,72 @@ def update_subject_ids() -> None:
     # Update the files table with the BIDS subject ID
     # get the files table
     with engine.connect() as conn, conn.begin():
-        files = pd.read_sql_table("files", conn)
+        files = pd.read_sql("""SELECT files.file_id, files.file_path, bids.relative_sidecar_path FROM files
+                               LEFT JOIN bids ON bids.file_id = files.file_id""", conn)
     # check if the files table is empty
     if files.empty:
         workflow_logger.error("Files table is empty.")
         exit()
        
     # create a new column for BIDS subject ID
-    files['BIDS_subject_id'] = files['file_path'].apply(lambda x: x.split("/")[-1].split("_")[0].replace("sub-", "").strip().upper())
-    # Add the real subject ID to the files table
-    files['subject_id'] = files['BIDS_subject_id'].apply(lambda x: subjects[subjects['BIDS_subject_id'] == x]['subject_id'].values[0] if not subjects[subjects['BIDS_subject_id'] == x]['subject_id'].empty else None)
-    # Drop BIDS_subject_id column
-    files.drop(columns=['BIDS_subject_id'], inplace=True)
+    files['BIDS_subject_id'] = files['file_path'].apply(get_bids_subject_id)
+    # Add the real subject ID to the files table, the first subject is used if a BIDS subject ID is not unique
+    subjects = subjects.drop_duplicates('BIDS_subject_id')
+    subject_ids = dict(zip(subjects['BIDS_subject_id'], subjects['subject_id'].tolist()))
+    # (kept as list, a column with missing values would convert the integer IDs to floats)
+    new_subject_ids = [subject_ids.get(bids_subject_id) for bids_subject_id in files['BIDS_subject_id']]
+
+    # Update the changed subject IDs in the files table of the SQLite DB
+    updated = update_column_values(CONFIG["db_path"], "files", "file_id", "subject_id", zip(files['file_id'], new_subject_ids))
+    workflow_logger.debug(f"Subject IDs updated: {updated} files")
+
+def update_subject_ids_sql() -> None:
+    """
+    Function to update the Subject IDs in the files table of SQLite DB within the database (UPDATE ... FROM),
+    without reading the tables into memory. Only rows whose subject_id changes are written.
 
-    # Update the files table in the SQLite DB
-    with engine.connect() as conn, conn.begin():
-        files.to_sql("files", conn, if_exists='replace', index=False)
+    return: None
+    """
+    # reuse the connection of an active session
+    conn, session = open_connection(CONFIG["db_path"])
+    # the BIDS subject ID of a file is derived from its file name, as in update_subject_ids
+    conn.create_function("bids_subject_id", 1, get_bids_subject_id, deterministic=True)
+    # subjects with their BIDS subject ID, the first subject is used if a BIDS subject ID is not unique
+    # (the bare column subject_id is taken from the row with MIN(rowid))
+    subjects = """SELECT UPPER(TRIM(REPLACE(REPLACE(patient_id_acr, '-', ''), '_', ''))) AS bids_subject_id, subject_id, MIN(rowid)
+                  FROM subjects GROUP BY bids_subject_id"""
+    try:
+        if conn.execute("SELECT COUNT(*) FROM subjects").fetchone()[0] == 0:
+            workflow_logger.error("Subjects table is empty.")
+            exit()
+        updated = conn.execute(f"""UPDATE files SET subject_id = s.subject_id FROM ({subjects}) AS s
+                                   WHERE s.bids_subject_id = bids_subject_id(files.file_path)
+                                   AND files.subject_id IS NOT s.subject_id""").rowcount
+        # files without subject get no subject_id
+        # (NOT EXISTS instead of NOT IN, which is NULL as soon as a subject has no patient_id_acr)
+        updated += conn.execute(f"""UPDATE files SET subject_id = NULL
+                                    WHERE subject_id IS NOT NULL
+                                    AND NOT EXISTS (SELECT 1 FROM ({subjects}) AS s
+                                                    WHERE s.bids_subject_id = bids_subject_id(files.file_path))""").rowcount
+        commit_connection(conn, session)
+        workflow_logger.debug(f"Subject IDs updated: {updated} files")
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        close_connection(conn, session)
 
 def update_transformation_id() -> None:
     """
     Function to update the Transformation ID in the files table of SQLite DB.
+    The transformations are resolved with a dictionary keyed by (identity, target_id, transform_id)
+    and the sidecars with a lookup by their relative path, so the step is linear in the number of files.
+    Only the changed transformation_id values are written to the files table.
 
     return: None
     """
     # Get the Transformation table from the SQLite DB
-    engine = create_engine("sqlite:///"+CONFIG["db_path"])  
+    engine = create_database_engine(CONFIG["db_path"])  
     with engine.connect() as conn, conn.begin():
         transformations = pd.read_sql_table("transformations", conn)
 
@@ -114,9 +187,14 @@ def update_transformation_id() -> None:
         workflow_logger.error("Transformations table is empty.")
         exit()
 
+    # Index the transformations by (identity, target_id, transform_id)
+    transformation_ids = dict(zip(zip(transformations['identity'], transformations['target_id'], transformations['transform_id']),
+                                  transformations['transformation_id'].tolist()))
+
     # Get the files table from the SQLite DB
     with engine.connect() as conn, conn.begin():
-        files = pd.read_sql_table("files", conn)
+        files = pd.read_sql("""SELECT files.file_id, files.file_path, bids.relative_sidecar_path FROM files
+                               LEFT JOIN bids ON bids.file_id = files.file_id""", conn)
 
     # check if the files table is empty
     if files.empty:
@@ -124,33 +202,64 @@ def update_transformation_id() -> None:
         exit()
 
     # USE the extracted data JSON file as dictionary which file has which transformations
-    # get the extracted data JSON file
-    extracted_data = pd.read_json(os.path.join(CONFIG['extraction_path'],'extracted_data.json'))
-    extracted_data.reset_index(drop=False, inplace=True)
-    extracted_data.rename(columns={"index":"file_name"}, inplace=True)
-    # drop al rows with no "transformations" mentioned in the "sidecardata" column
-    extracted_data = extracted_data[extracted_data['sidecardata'].apply(lambda x: 'transformations' in x.keys())]
-    # correct file_name column split by "." and take the first element
-    extracted_data['file_name'] = extracted_data['file_name'].apply(lambda x: x.split(".")[0].replace("_sidecar", ""))
-    # get the transformations_id from the transformations table and add it to the extracted_data table
-    extracted_data['transformations'] = extracted_data['sidecardata'].apply(lambda x: x['transformations'])
-    extracted_data['transformation_id'] = extracted_data['transformations'].apply(lambda x: transformations[(transformations['identity'] == x['identity']) & (transformations['target_id'] == x['target_id']) & (transformations['transform_id'] == x['transform_id'])]['transformation_id'])
-
-    # add a helper column to get the file name without the extension
-    files['file_name'] = files['file_path'].apply(lambda x: os.path.splitext(x)[0].split("/")[-1].split(".")[0])
-    # add the transformation_id to the files table
-    files['transformation_id'] = files['file_name'].apply(lambda x: extracted_data[extracted_data['file_name'] == x]['transformation_id'].values[0] if not extracted_data[extracted_data['file_name'] == x]['transformation_id'].empty else None)
-    # drop the helper column
-    files.drop(columns=['file_name'], inplace=True)
-
-    # Update the files table with the transformation_id
-    with engine.connect() as conn, conn.begin():
-        # Update the files table in the SQLite DB
-        files.to_sql("files", conn, if_exists='replace', index=False)
+    # the sidecars are keyed by their path relative to the BIDS directory, the relative_sidecar_path of the bids table
+    # or else derived from the file_path
+    extracted_file = None
+    if CONFIG.get('extraction_format', 'json') == 'ndjson':
+        # only keep an index (sidecar path -> byte offset) in memory, the records are read on demand
+        index = index_ndjson(get_extracted_data_file(), 'sidecar')
+        extracted_file = open(get_extracted_data_file(), 'rb')
+        get_sidecar = lambda sidecar_path: read_ndjson_record(extracted_file, index[sidecar_path])['sidecardata'] if sidecar_path in index else None
+    else:
+        sidecardata = read_json_to_dict(get_extracted_data_file())['sidecardata']
+        get_sidecar = sidecardata.get
+
+    def get_transformation_id(sidecar):
+        # files without "transformations" in their sidecar have no transformation_id
+        if 'transformations' not in sidecar:
+            return None
+        x = sidecar['transformations']
+        # get the transformations_id from the transformations table
+        return transformation_ids.get((x['identity'], x['target_id'], x['transform_id']))
+
+    # resolve the transformation_id of the files whose sidecar was extracted,
+    # files missing from the extraction (e.g. unchanged in an incremental run) keep their transformation_id
+    new_transformation_ids = []
+    try:
+        for file_id, file_path, relative_sidecar_path in zip(files['file_id'], files['file_path'], files['relative_sidecar_path']):
+            sidecar = get_sidecar(get_sidecar_path(file_path, relative_sidecar_path))
+            if sidecar is not None:
+                new_transformation_ids.append((file_id, get_transformation_id(sidecar)))
+    finally:
+        # the ndjson file is closed also if a record can not be read
+        if extracted_file is not None:
+            extracted_file.close()
+
+    # Update the changed transformation IDs in the files table of the SQLite DB
+    updated = update_column_values(CONFIG["db_path"], "files", "file_id", "transformation_id", new_transformation_ids)
+    workflow_logger.debug(f"Transformation IDs updated: {updated} files")
     
-def backpropation()-> None:
+# Sidecar keys and their columns, which are backpropagated from the tables with the same name (keyed by file_id)
+BACKPROPAGATION_COLUMNS = {
+    "files": ["subject_id", "electrode_id", "file_path", "file_type", "source_id"],
+    "bids": ["modality", "protocol_name", "stereotactic", "dicom_image_type", "acquisition_date_time", "relative_sidecar_path",
+             "bids_subject", "bids_session", "bids_extension", "bids_datatype", "bids_acquisition", "bids_suffix"],
+    "labels": ["hemisphere", "structure", "color", "comment"],
+}
+# Columns of the transformations table, which are backpropagated (keyed by identity, target_id, transform_id)
+BACKPROPAGATION_TRANSFORMATION_COLUMNS = ["transformation_id", "identity", "target_id", "transform_id"]
+
+def backpropation() -> dict:
     """
     Function to backpropagate the loaded data to the BIDS sidecar files.
+    The tables are indexed once, and a sidecar file is only rewritten if its content changes.
+    If the database has a change_log table, only the sidecar files of the files changed since the last
+    backpropagation are visited, otherwise all sidecar files of the BIDS directory. The changes of files
+    whose sidecar file is missing or can not be processed are kept in the change log.
+    The sidecar files are processed by backpropagation_workers threads. A sidecar file which
+    can not be processed does not stop the backpropagation, the errors are logged and returned.
+
+    return: dictionary of the errors keyed by sidecar file path
     """ 
     ## CHECKS
     # Check if config file is read successfully
@@ -171,127 +280,174 @@ def backpropation()-> None:
         exit()
         
     ## BACKPROPAGATION
-    # Get all _sidecar.json files in the BIDS directory
-    sidecar_files = list(Path(CONFIG['bids_dir_path']).rglob('*_sidecar.json'))
-    # Check if there are any _sidecar.json files
-    if not sidecar_files:
-        workflow_logger.error(f"No _sidecar.json files found in {CONFIG['bids_dir_path']}")
-        exit()
+    # the change log is read and cleared with one connection
+    with DatabaseSession(CONFIG['db_path']):
+        # Get the _sidecar.json files of the changed files
+        change_log = read_change_log(CONFIG['db_path'])
+        if change_log is not None:
+            changed_files, last_change_id = change_log
+            # file_ids of the sidecar files, whose changes are kept in the change log if they are not written back
+            sidecar_file_ids = {}
+            missing_file_ids = set()
+            for file_id, file_path, relative_sidecar_path in changed_files:
+                sidecar_file = Path(CONFIG['bids_dir_path'], get_sidecar_path(file_path, relative_sidecar_path))
+                if sidecar_file.exists():
+                    sidecar_file_ids.setdefault(sidecar_file, []).append(file_id)
+                else:
+                    workflow_logger.warning(f"Sidecar file of changed file {file_id} not found, its changes are kept: {sidecar_file}")
+                    missing_file_ids.add(file_id)
+            sidecar_files = list(sidecar_file_ids)
+            if not sidecar_files:
+                workflow_logger.info("Backpropagation: no files changed since the last backpropagation.")
+                if last_change_id is not None:
+                    clear_change_log(CONFIG['db_path'], last_change_id, missing_file_ids)
+                return {}
+        else:
+            # Get all _sidecar.json files in the BIDS directory
+            last_change_id = None
+            sidecar_files = list(Path(CONFIG['bids_dir_path']).rglob('*_sidecar.json'))
+            # Check if there are any _sidecar.json files
+            if not sidecar_files:
+                workflow_logger.error(f"No _sidecar.json files found in {CONFIG['bids_dir_path']}")
+                exit()
     
-    # Get the files table from the SQLite DB
-    engine = create_engine("sqlite:///"+CONFIG["db_path"])
-    with engine.connect() as conn, conn.begin():
-        files = pd.read_sql_table("files", conn)
+        # Get the tables from the SQLite DB, indexed by their keys
+        indexes = get_backpropagation_indexes()
+
+        # Loop through all the _sidecar.json files
+        written = 0
+        errors = {}
+        progress_step = max(len(sidecar_files) // 10, 1)
+        num_workers = CONFIG.get('backpropagation_workers', 1)
+        for count, (sidecar_file, rewritten, error) in enumerate(iter_backpropagate_sidecars(sidecar_files, indexes, num_workers), 1):
+            if error is not None:
+                errors[str(sidecar_file)] = str(error)
+                workflow_logger.error(f"Backpropagation failed for {sidecar_file}: {error}")
+            elif rewritten:
+                written += 1
+            if count % progress_step == 0 or count == len(sidecar_files):
+                workflow_logger.info(f"Backpropagation progress: {count}/{len(sidecar_files)} sidecar files")
+        workflow_logger.info(f"Backpropagation: {written} of {len(sidecar_files)} sidecar files updated, {len(errors)} failed")
+        # the changes are kept in the change log, until their sidecar files have been backpropagated
+        if last_change_id is not None:
+            failed_file_ids = [file_id for sidecar_file in errors for file_id in sidecar_file_ids[Path(sidecar_file)]]
+            clear_change_log(CONFIG['db_path'], last_change_id, missing_file_ids.union(failed_file_ids))
+        return errors
+
+def iter_backpropagate_sidecars(sidecar_files:list, indexes:dict, num_workers:int=1):
+    """
+    Function to backpropagate the sidecar files with num_workers threads, in the order of sidecar_files.
+    Only a bounded number of files is submitted ahead.
 
-    # check if the files table is empty
-    if files.empty:
-        workflow_logger.error("Files table is empty.")
-        exit()
-    
-    # Get the bids table from the SQLite DB
-    with engine.connect() as conn, conn.begin():
-        bids = pd.read_sql_table("bids", conn)
+    return: generator of the try_backpropagate_sidecar results
+    """
+    if num_workers <= 1:
+        yield from (try_backpropagate_sidecar(sidecar_file, indexes) for sidecar_file in sidecar_files)
+        return
+    sidecar_files = iter(sidecar_files)
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        while True:
+            batch = list(itertools.islice(sidecar_files, num_workers * 16))
+            if not batch:
+                break
+            yield from executor.map(try_backpropagate_sidecar, batch, itertools.repeat(indexes))
+
+def try_backpropagate_sidecar(sidecar_file, indexes:dict) -> tuple:
+    """
+    Function to backpropagate a sidecar file like backpropagate_sidecar, but returns the error instead of raising it,
+    so that one bad sidecar file does not stop the worker pool.
 
-    # check if the bids table is empty
-    if bids.empty:
-        workflow_logger.error("Bids table is empty.")
-        exit()
-    
-    # Get the labels table from the SQLite DB
-    with engine.connect() as conn, conn.begin():
-        labels = pd.read_sql_table("labels", conn)
-    
-    # check if the labels table is empty
-    if labels.empty:
-        workflow_logger.error("Labels table is empty.")
-        exit()
-    
-    # Get the transformations table from the SQLite DB
-    with engine.connect() as conn, conn.begin():
-        transformations = pd.read_sql_table("transformations", conn)
-    
-    # check if the transformations table is empty
-    if transformations.empty:
-        workflow_logger.error("Transformations table is empty.")
-        exit()
-    
+    return: tuple of the sidecar file, True if it was rewritten and the error (None on success)
+    """
+    try:
+        return sidecar_file, backpropagate_sidecar(sidecar_file, indexes), None
+    except Exception as e:
+        return sidecar_file, False, e
+
+def get_backpropagation_indexes() -> dict:
+    """
+    Function to read the tables of the SQLite DB into dictionaries of rows,
+    keyed by file_id (files, bids, labels) or by (identity, target_id, transform_id) (transformations).
+
+    return: dictionary of the indexes keyed by table name
+    """
+    engine = create_database_engine(CONFIG["db_path"])
+    indexes = {}
+    for table_name in list(BACKPROPAGATION_COLUMNS) + ["transformations"]:
+        with engine.connect() as conn, conn.begin():
+            table = pd.read_sql(f"SELECT * FROM {table_name}", conn)
+
+        # check if the table is empty
+        if table.empty:
+            workflow_logger.error(f"{table_name.capitalize()} table is empty.")
+            exit()
+
+        if table_name == "transformations":
+            keys = zip(table["identity"], table["target_id"], table["transform_id"])
+        else:
+            keys = table["file_id"]
+        # missing values of text columns are None, as in the object columns of pandas < 3 (written as "None"),
+        # missing numbers stay NaN (written as "")
+        text_columns = table.select_dtypes(exclude="number").columns
+        table = table.astype(object)
+        table[text_columns] = table[text_columns].where(table[text_columns].notna(), None)
+        # the first row is used if a key is not unique
+        rows = table.to_dict('records')
+        indexes[table_name] = {}
+        for key, row in zip(keys, rows):
+            indexes[table_name].setdefault(key, row)
+    return indexes
+
+def to_sidecar_value(value) -> str:
+    """
+    Function to convert a value of the SQLite DB to a sidecar value, "null" or "nan" are replaced with "".
+
+    return: sidecar value
+    """
+    return str(value).replace("null", "").replace("nan", "")
 
-    # Loop through all the _sidecar.json files
-    for sidecar_file in sidecar_files:
-        # open sidecar file
-        with open(sidecar_file) as f:
-            sidecar_json = json.load(f)
-
-        # check wheter the sidecar file contains the key "files"
-        if "files" in sidecar_json.keys():
-            file = sidecar_json["files"]
-            # update the json "file" according to the row in files table of sqlite db
-            # get the file_id from the json file
-            file_id = file["file_id"]
-            # get the row in the files table with the file_id
-            file_row = files[files["file_id"] == file_id]
-            # update the file json replace null or Nan with ""
-            file["subject_id"] = str(file_row["subject_id"].values[0]).replace("null", "").replace("nan", "")
-            file["electrode_id"] = str(file_row["electrode_id"].values[0]).replace("null", "").replace("nan", "")
-            file["file_path"] = str(file_row["file_path"].values[0]).replace("null", "").replace("nan", "")
-            file["file_type"] = str(file_row["file_type"].values[0]).replace("null", "").replace("nan", "")
-            file["source_id"] = str(file_row["source_id"].values[0]).replace("null", "").replace("nan", "")
-
-            sidecar_json["files"] = file
-
-            # check wheter the sidecar file contains the key "bids"
-            if "bids" in sidecar_json.keys():
-                bid = sidecar_json["bids"]
-                # update the json "bids" according to the row in bids table of sqlite db
-                # get the row in the bids table with the file_id
-                bid_row = bids[bids["file_id"] == file_id]
-                # update the bids json 
-                bid["modality"] = str(bid_row["modality"].values[0]).replace("null", "").replace("nan", "")
-                bid["protocol_name"] = str(bid_row["protocol_name"].values[0]).replace("null", "").replace("nan", "")
-                bid["stereotactic"] = str(bid_row["stereotactic"].values[0]).replace("null", "").replace("nan", "")
-                bid["dicom_image_type"] = str(bid_row["dicom_image_type"].values[0]).replace("null", "").replace("nan", "")
-                bid["acquisition_date_time"] = str(bid_row["acquisition_date_time"].values[0]).replace("null", "").replace("nan", "")
-                bid["relative_sidecar_path"] = str(bid_row["relative_sidecar_path"].values[0]).replace("null", "").replace("nan", "")
-                bid["bids_subject"] = str(bid_row["bids_subject"].values[0]).replace("null", "").replace("nan", "")
-                bid["bids_session"] = str(bid_row["bids_session"].values[0]).replace("null", "").replace("nan", "")
-                bid["bids_extension"] = str(bid_row["bids_extension"].values[0]).replace("null", "").replace("nan", "")
-                bid["bids_datatype"] = str(bid_row["bids_datatype"].values[0]).replace("null", "").replace("nan", "")
-                bid["bids_acquisition"] = str(bid_row["bids_acquisition"].values[0]).replace("null", "").replace("nan", "")
-                bid["bids_suffix"] = str(bid_row["bids_suffix"].values[0]).replace("null", "").replace("nan", "")
-
-                sidecar_json["bids"] = bid
-
-            # check wheter the sidecar file contains the key "labels"
-            if "labels" in sidecar_json.keys():
-                label = sidecar_json["labels"]
-                # update the json "labels" according to the row in labels table of sqlite db
-                # get the row in the labels table with the file_id
-                label_row = labels[labels["file_id"] == file_id]
-                # update the labels json
-                label["hemisphere"] = str(label_row["hemisphere"].values[0]).replace("null", "").replace("nan", "")
-                label["structure"] = str(label_row["structure"].values[0]).replace("null", "").replace("nan", "")
-                label["color"] = str(label_row["color"].values[0]).replace("null", "").replace("nan", "")
-                label["comment"] = str(label_row["comment"].values[0]).replace("null", "").replace("nan", "")
-
-                sidecar_json["labels"] = label
-                
-            # check wheter the sidecar file contains the key "transformations"
-            if "transformations" in sidecar_json.keys():
-                transformation = sidecar_json["transformations"]
-                # update the json "transformations" according to the row in transformations table of sqlite db
-                # get the row in the transformations table with the identity, target_id, transform_id
-                transformation_row = transformations[(transformations["identity"] == transformation["identity"]) & (transformations["target_id"] == transformation["target_id"]) & (transformations["transform_id"] == transformation["transform_id"])]
-                # update the transformations json
-                transformation["transformation_id"] = str(transformation_row["transformation_id"].values[0]).replace("null", "").replace("nan", "")
-                transformation["identity"] = str(transformation_row["identity"].values[0]).replace("null", "").replace("nan", "")
-                transformation["target_id"] = str(transformation_row["target_id"].values[0]).replace("null", "").replace("nan", "")
-                transformation["transform_id"] = str(transformation_row["transform_id"].values[0]).replace("null", "").replace("nan", "")
-                
-                sidecar_json["transformations"] = transformation
-            
-            # write the updated sidecar file
-            with open(sidecar_file, 'w') as f:
-                json.dump(sidecar_json, f, indent=4)
+def backpropagate_sidecar(sidecar_file, indexes:dict) -> bool:
+    """
+    Function to update a sidecar file according to the rows of the SQLite DB.
+    The file is only rewritten (atomically) if its content changes.
+
+    return: True if the sidecar file was rewritten
+    """
+    # open sidecar file
+    with open(sidecar_file) as f:
+        sidecar_json = json.load(f)
+
+    # check wheter the sidecar file contains the key "files"
+    if "files" not in sidecar_json.keys():
+        return False
+    file_id = sidecar_json["files"]["file_id"]
+
+    # update the json elements according to the rows with the file_id in the tables of sqlite db
+    updated_json = dict(sidecar_json)
+    for table_name, columns in BACKPROPAGATION_COLUMNS.items():
+        if table_name not in sidecar_json.keys():
+            continue
+        row = indexes[table_name].get(file_id)
+        if row is None:
+            workflow_logger.warning(f"No row in table {table_name} for file_id {file_id}: {sidecar_file}")
+            continue
+        updated_json[table_name] = dict(sidecar_json[table_name], **{column: to_sidecar_value(row[column]) for column in columns})
+
+    # check wheter the sidecar file contains the key "transformations"
+    if "transformations" in sidecar_json.keys():
+        transformation = sidecar_json["transformations"]
+        # get the row in the transformations table with the identity, target_id, transform_id
+        row = indexes["transformations"].get((transformation["identity"], transformation["target_id"], transformation["transform_id"]))
+        if row is None:
+            workflow_logger.warning(f"No row in table transformations for file_id {file_id}: {sidecar_file}")
+        else:
+            updated_json["transformations"] = dict(transformation, **{column: to_sidecar_value(row[column]) for column in BACKPROPAGATION_TRANSFORMATION_COLUMNS})
+
+    # write the updated sidecar file, if its content changed
+    if updated_json == sidecar_json:
+        return False
+    write_json_atomic(str(sidecar_file), updated_json, indent=4)
+    return True
 
 # Post Transformation program
 if __name__ == "__main__":
@@ -1,10 +1,15 @@
 from PyUtilities.setupFunctions import read_config_file
 from PyUtilities.edit_add_bids_templates import copy_templates_to_bids_root, add_participants_ids_to_tsv, change_dataset_name
-from PyUtilities.utility_functions import mkdir_if_not_exists, calculate_hash
+from PyUtilities.read_write import SidecarWriter
+from PyUtilities.utility_functions import mkdir_if_not_exists, copy_and_hash_if_changed, compress_and_hash_if_changed, get_relative_path
+from PyUtilities.fileFunctions import set_hash_cache
+from PyUtilities.niftiHeaderFunctions import try_read_nifti_header, NIFTI_HEADER_COLUMNS
+from PyUtilities.databaseFunctions import insert_rows_batched, begin_change_run
 import logging
 import pandas as pd
+import concurrent.futures
+import itertools
 import os
-import shutil
 
 # Configure logger
 workflow_logger = logging.getLogger('workflow_logger')
@@ -19,6 +24,19 @@ workflow_logger.addHandler(file_handler1)
 
 CONFIG_FILE_PATH = 'config.json'
 CONFIG = read_config_file(CONFIG_FILE_PATH)
+# Number of bytes read and hashed at once, set from hash_chunk_size_mib by init_hashing
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def init_hashing(config):
+    """
+    Sets the hash cache and the hash chunk size from the config. Called by NIFTI2BIDS once the config is
+    validated and as initializer of the worker processes, so that they use the cache as well.
+    :param config: configuration dictionary
+    :return: None
+    """
+    global HASH_CHUNK_SIZE
+    set_hash_cache(config.get("hash_cache_path"), config.get("hash_cache_max_entries", 100000))
+    HASH_CHUNK_SIZE = int(config.get("hash_chunk_size_mib", 1) * 1024 * 1024)
 
 def get_datatype_name(file_name):
     """
@@ -82,7 +100,52 @@ def get_suffix_name(sequence):
     return suffix
 
 # create image functions
-def create_bids_mr_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig):
+def sidecar_data(*infos):
+    """
+    Merges the infos of an image into the content of its sidecar file, all values are written as strings.
+    :param infos: dictionaries of the files, bids (and labels) infos
+    :return: dictionary of the sidecar file
+    """
+    return {key: str(value) for info in infos for key, value in info.items()}
+
+
+def get_nifti_header_values(file_path):
+    """
+    Reads the image geometry from the NIfTI header (the volume is not decompressed), if read_nifti_headers is set.
+    :param file_path: path of the NIfTI file
+    :return: dictionary of the NIFTI_HEADER_COLUMNS, empty if disabled or the header could not be read
+    """
+    if not CONFIG.get("read_nifti_headers", False):
+        return {}
+    return try_read_nifti_header(file_path) or {}
+
+
+def get_bids_relative_path(path):
+    """
+    Returns the path of a file in the BIDS directory relative to the BIDS root directory, e.g. 'sub-01/ses-Pre/anat/...'
+    :param path: path of the file
+    :return: relative path as string
+    """
+    return get_relative_path(path, CONFIG['datasystem_root']+CONFIG['bids_dir_name'])
+
+
+def materialize_image(nifti_file_path, bids_file_path):
+    """
+    Stores a NIFTI file in the BIDS directory, unless it is already there, and returns its hash.
+    Compressed files (.nii.gz) are copied, uncompressed files (.nii) are compressed with block-parallel gzip,
+    the hash of the .nii.gz file is calculated in the same pass.
+    :param nifti_file_path: path of the NIFTI file in the 4BIDS directory
+    :param bids_file_path: path of the .nii.gz file in the BIDS directory
+    :return: hash of the .nii.gz file in the BIDS directory
+    """
+    if nifti_file_path.endswith(".nii"):
+        file_id, _ = compress_and_hash_if_changed(nifti_file_path, bids_file_path, level=CONFIG.get("gzip_level", 6), num_workers=CONFIG.get("gzip_workers", 4))
+    else:
+        file_id, _ = copy_and_hash_if_changed(nifti_file_path, bids_file_path, chunk_size=HASH_CHUNK_SIZE, strategy=CONFIG.get("copy_strategy", "auto"), immutable=CONFIG.get("copy_hardlink_sources", False))
+    return file_id
+
+
+def create_bids_mr_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig, sidecar_writer):
     # get the file sequence
     nifti_file_sequence = nifti_file_name.split("_")[1]
     if nifti_file_sequence == "DTI":
@@ -113,14 +176,19 @@ def create_bids_mr_image(nifti_file_path, nifti_file_name, subject_dir, patientc
     bids_file_name = f"sub-{patientconfig['bids_id']}_ses-{nifti_file_prepost}_acq-mr{nifti_file_sequence}_{get_suffix_name(nifti_file_sequence)}.nii.gz"
     # create the BIDS file path
     bids_file_path = os.path.join(datatype_dir, bids_file_name)
-    # copy the NIFTI file to the BIDS directory
-    shutil.copy2(nifti_file_path, bids_file_path)
-
+    # copy (or compress) the NIFTI file to the BIDS directory and hash it in the same pass, unless it is already there
     #Preparation for the dictionary
-    file_id = calculate_hash(bids_file_path)
+    file_id = materialize_image(nifti_file_path, bids_file_path)
+    # read the image geometry from the NIfTI header
+    header_values = get_nifti_header_values(bids_file_path)
+
+    # create the BIDS sidecar file name
+    bids_sidecar_name = f"sub-{patientconfig['bids_id']}_ses-{nifti_file_prepost}_acq-mr{nifti_file_sequence}_{get_suffix_name(nifti_file_sequence)}.json"
+    # create the BIDS sidecar file path
+    bids_sidecar_path = os.path.join(datatype_dir, bids_sidecar_name)
 
-    # correct bids_file_path only until BIDS root directory for storage in the database
-    bids_file_path = os.path.join(CONFIG["bids_dir_name"],bids_file_path.split(CONFIG["bids_dir_name"])[1])
+    # correct bids_file_path relative to the BIDS root directory for storage in the database, as the sidecar ETL stores it
+    bids_file_path = get_bids_relative_path(bids_file_path)
     # correct nifti_file_path only until for_bids directory for storage in the database
     nifti_file_path = os.path.join(CONFIG["4bids_dir_name"],nifti_file_path.split(CONFIG["4bids_dir_name"])[1])
 
@@ -136,6 +204,7 @@ def create_bids_mr_image(nifti_file_path, nifti_file_name, subject_dir, patientc
                     "protocol_name": nifti_file_sequence,
                     "stereotactic": nifti_file_stereo,
                     "dicom_image_type": "BRAINLAB",
+                    "relative_sidecar_path": get_bids_relative_path(bids_sidecar_path),
                     "bids_subject": patientconfig['bids_id'],
                     "bids_session": nifti_file_prepost,
                     "bids_extension": "nii.gz",
@@ -143,25 +212,13 @@ def create_bids_mr_image(nifti_file_path, nifti_file_name, subject_dir, patientc
                     "bids_acquisition": "MR-"+nifti_file_sequence,
                     "bids_suffix": get_suffix_name(nifti_file_sequence)
                     }
-    # create a json sidecar file
-    # create the BIDS sidecar file name
-    bids_sidecar_name = f"sub-{patientconfig['bids_id']}_ses-{nifti_file_prepost}_acq-mr{nifti_file_sequence}_{get_suffix_name(nifti_file_sequence)}.json"
-    # create the BIDS sidecar file path
-    bids_sidecar_path = os.path.join(datatype_dir, bids_sidecar_name)
-    # create the sidecar file with content from the dataframes
-    with open(bids_sidecar_path, 'w') as f:
-        f.write("{\n")
-        for key, value in files_info.items():
-            f.write(f'"{key}": "{value}",\n')
-        for key, value in bids_info.items():
-            f.write(f'"{key}": "{value}",\n')
-        # remove the last comma
-        f.seek(f.tell()-2)
-        f.write("\n}")
+    bids_info.update(header_values)
+    # create a json sidecar file with content from the dataframes, only rewritten (atomically) if the content changed
+    sidecar_writer.write(bids_sidecar_path, sidecar_data(files_info, bids_info))
     return files_info, bids_info
 
 
-def create_bids_ct_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig):
+def create_bids_ct_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig, sidecar_writer):
     # get the file stereo
     nifti_file_stereo = nifti_file_name.split("_")[1]
     # get the file pre/post
@@ -180,14 +237,19 @@ def create_bids_ct_image(nifti_file_path, nifti_file_name, subject_dir, patientc
     bids_file_name = f"sub-{patientconfig['bids_id']}_ses-{nifti_file_prepost}_acq-CT_{get_suffix_name('CT')}.nii.gz"
     # create the BIDS file path
     bids_file_path = os.path.join(datatype_dir, bids_file_name)
-    # copy the NIFTI file to the BIDS directory
-    shutil.copy2(nifti_file_path, bids_file_path)
-
+    # copy (or compress) the NIFTI file to the BIDS directory and hash it in the same pass, unless it is already there
     #Preparation for the dictionary
-    file_id = calculate_hash(bids_file_path)
+    file_id = materialize_image(nifti_file_path, bids_file_path)
+    # read the image geometry from the NIfTI header
+    header_values = get_nifti_header_values(bids_file_path)
 
-    # correct bids_file_path only until BIDS root directory for storage in the database
-    bids_file_path = os.path.join(CONFIG["bids_dir_name"],bids_file_path.split(CONFIG["bids_dir_name"])[1])
+    # create the BIDS sidecar file name
+    bids_sidecar_name = f"sub-{patientconfig['bids_id']}_ses-{nifti_file_prepost}_acq-CT_{get_suffix_name('CT')}.json"
+    # create the BIDS sidecar file path
+    bids_sidecar_path = os.path.join(datatype_dir, bids_sidecar_name)
+
+    # correct bids_file_path relative to the BIDS root directory for storage in the database, as the sidecar ETL stores it
+    bids_file_path = get_bids_relative_path(bids_file_path)
     # correct nifti_file_path only until for_bids directory for storage in the database
     nifti_file_path = os.path.join(CONFIG["4bids_dir_name"],nifti_file_path.split(CONFIG["4bids_dir_name"])[1])
 
@@ -203,6 +265,7 @@ def create_bids_ct_image(nifti_file_path, nifti_file_name, subject_dir, patientc
                     "protocol_name": "",
                     "stereotactic": nifti_file_stereo,
                     "dicom_image_type": "BRAINLAB",
+                    "relative_sidecar_path": get_bids_relative_path(bids_sidecar_path),
                     "bids_subject": patientconfig['bids_id'],
                     "bids_session": nifti_file_prepost,
                     "bids_extension": "nii.gz",
@@ -210,25 +273,13 @@ def create_bids_ct_image(nifti_file_path, nifti_file_name, subject_dir, patientc
                     "bids_acquisition": "CT",
                     "bids_suffix": get_suffix_name('CT')
                     }
-    # create a json sidecar file
-    # create the BIDS sidecar file name
-    bids_sidecar_name = f"sub-{patientconfig['bids_id']}_ses-{nifti_file_prepost}_acq-CT_{get_suffix_name('CT')}.json"
-    # create the BIDS sidecar file path
-    bids_sidecar_path = os.path.join(datatype_dir, bids_sidecar_name)
-    # create the sidecar file with content from the dataframes
-    with open(bids_sidecar_path, 'w') as f:
-        f.write("{\n")
-        for key, value in files_info.items():
-            f.write(f'"{key}": "{value}",\n')
-        for key, value in bids_info.items():
-            f.write(f'"{key}": "{value}",\n')
-        # remove the last comma
-        f.seek(f.tell()-2)
-        f.write("\n}")
+    bids_info.update(header_values)
+    # create a json sidecar file with content from the dataframes, only rewritten (atomically) if the content changed
+    sidecar_writer.write(bids_sidecar_path, sidecar_data(files_info, bids_info))
     return files_info, bids_info
     
 
-def create_bids_label_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig):
+def create_bids_label_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig, sidecar_writer):
     # get the file region
     # replace _ with - in the region name | e.g. 'hippocampus_left'->'hippocampus-left'
     nifti_file_region = "-".join(nifti_file_name.split("_"))
@@ -239,12 +290,18 @@ def create_bids_label_image(nifti_file_path, nifti_file_name, subject_dir, patie
     bids_file_name = f"sub-{patientconfig['bids_id']}_ses-Pre_acq-mrWair{nifti_file_region}_label.nii.gz"
     # create the BIDS file path
     bids_file_path = os.path.join(datatype_dir, bids_file_name)
-    # copy the NIFTI file to the BIDS directory
-    shutil.copy2(nifti_file_path, bids_file_path)
-    file_id = calculate_hash(bids_file_path)
+    # copy (or compress) the NIFTI file to the BIDS directory and hash it in the same pass, unless it is already there
+    file_id = materialize_image(nifti_file_path, bids_file_path)
+    # read the image geometry from the NIfTI header
+    header_values = get_nifti_header_values(bids_file_path)
 
-    # correct bids_file_path only until BIDS root directory for storage in the database
-    bids_file_path = os.path.join(CONFIG["bids_dir_name"],bids_file_path.split(CONFIG["bids_dir_name"])[1])
+    # create the BIDS sidecar file name
+    bids_sidecar_name = f"sub-{patientconfig['bids_id']}_ses-Pre_acq-mrWair{nifti_file_region}_label.json"
+    # create the BIDS sidecar file path
+    bids_sidecar_path = os.path.join(datatype_dir, bids_sidecar_name)
+
+    # correct bids_file_path relative to the BIDS root directory for storage in the database, as the sidecar ETL stores it
+    bids_file_path = get_bids_relative_path(bids_file_path)
     # correct nifti_file_path only until for_bids directory for storage in the database
     nifti_file_path = os.path.join(CONFIG["4bids_dir_name"],nifti_file_path.split(CONFIG["4bids_dir_name"])[1])
 
@@ -260,6 +317,7 @@ def create_bids_label_image(nifti_file_path, nifti_file_name, subject_dir, patie
                     "protocol_name": "WAIR",
                     "stereotactic": None,
                     "dicom_image_type": "BRAINLAB",
+                    "relative_sidecar_path": get_bids_relative_path(bids_sidecar_path),
                     "bids_subject": patientconfig['bids_id'],
                     "bids_session": "Pre",
                     "bids_extension": "nii.gz",
@@ -267,34 +325,30 @@ def create_bids_label_image(nifti_file_path, nifti_file_name, subject_dir, patie
                     "bids_acquisition": "MR-WAIR-"+nifti_file_region,
                     "bids_suffix": "label"
                     }
+    bids_info.update(header_values)
     labels_info = { "file_id": file_id,    
                     "hemisphere": nifti_file_name.split("_")[0],
                     "structure": "-".join(nifti_file_name.split("_")[1:])
                     }
-    # create a json sidecar file
-    # create the BIDS sidecar file name
-    bids_sidecar_name = f"sub-{patientconfig['bids_id']}_ses-Pre_acq-mrWair{nifti_file_region}_label.json"
-    # create the BIDS sidecar file path
-    bids_sidecar_path = os.path.join(datatype_dir, bids_sidecar_name)
-    # create the sidecar file with content from the dataframes
-    with open(bids_sidecar_path, 'w') as f:
-        f.write("{\n")
-        for key, value in files_info.items():
-            f.write(f'"{key}": "{value}",\n')
-        for key, value in bids_info.items():
-            f.write(f'"{key}": "{value}",\n')
-        for key, value in labels_info.items():
-            f.write(f'"{key}": "{value}",\n')
-        # remove the last comma
-        f.seek(f.tell()-2)
-        f.write("\n}")
+    # create a json sidecar file with content from the dataframes, only rewritten (atomically) if the content changed
+    sidecar_writer.write(bids_sidecar_path, sidecar_data(files_info, bids_info, labels_info))
     return files_info, bids_info , labels_info
 
 # Main Workflow
 def NIFTI2BIDS():
     """
     Main workflow to convert NIFTI files to BIDS format
+    The patients are converted by nifti2bids_workers processes in parallel, their results are merged at the end.
+
+    :return: dataframes of the files, bids and labels infos of all converted images
     """
+    ## CHECKS
+    # Check if config file is read successfully
+    if CONFIG is None:
+        workflow_logger.error("Config file not found or not read successfully.")
+        exit()
+    init_hashing(CONFIG)
+
     ## INITIALIZE empty BIDS datastructure
     # define directory paths
     repository_root_dir = CONFIG['repository_root']
@@ -339,29 +393,111 @@ def NIFTI2BIDS():
     # add the participant ids to the participants tsv
     participants_df = add_participants_ids_to_tsv(bids_root_dir, subjects)
 
-    # create a dataframe with all columns for the BIDS info
-    files_info_df = pd.DataFrame(columns=["file_id", "subject_id","file_path", "file_type", "file_origin"])
-    bids_info_df = pd.DataFrame(columns=["file_id", "modality", "protocol_name", "stereotactic", "dicom_image_type", "bids_subject", "bids_session", "bids_extension", "bids_datatype","bids_acquisition","bids_suffix"])
-    labels_info_df = pd.DataFrame(columns=["file_id", "hemisphere","structure"])
-
-    # Iterate over all Patients
+    # Iterate over all Patients, with nifti2bids_workers processes in parallel
     workflow_logger.info("Iterating over all patients")
-    for patient_idx in range(len(subjects)):
-        # select the patient
-        patientconfig = subjects.iloc[patient_idx]
-        # create the subject BIDS directory and the derivatives directory
-        subject_dir = os.path.join(bids_root_dir, f"sub-{patientconfig['bids_id']}")
-        mkdir_if_not_exists(subject_dir)
-        derivatives_subject_dir = os.path.join(derivatives_patients_dir,f"sub-{patientconfig['bids_id']}")
-        mkdir_if_not_exists(derivatives_subject_dir)
-
-        # get the subject NIFTI directory
-        subject_nifti_dir = os.path.join(forbids_root_dir, patientconfig['folder_name'])
-        image_idx = 0
+    patientconfigs = [subjects.iloc[patient_idx] for patient_idx in range(len(subjects))]
+    num_workers = CONFIG.get('nifti2bids_workers', 1)
+    if num_workers <= 1:
+        patient_results = [create_bids_patient(patientconfig, bids_root_dir, derivatives_patients_dir, forbids_root_dir) for patientconfig in patientconfigs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(num_workers, initializer=init_hashing, initargs=(CONFIG,)) as executor:
+            patient_results = list(executor.map(create_bids_patient, patientconfigs, itertools.repeat(bids_root_dir),
+                                                itertools.repeat(derivatives_patients_dir), itertools.repeat(forbids_root_dir)))
+
+    # merge the results of all patients into dataframes with all columns for the BIDS info
+    files_info_df = pd.DataFrame([info for files_infos, _, _ in patient_results for info in files_infos],
+                                 columns=["file_id", "subject_id","file_path", "file_type", "file_origin"])
+    bids_info_df = pd.DataFrame([info for _, bids_infos, _ in patient_results for info in bids_infos],
+                                columns=get_table_columns("bids"))
+    labels_info_df = pd.DataFrame([info for _, _, labels_infos in patient_results for info in labels_infos],
+                                  columns=["file_id", "hemisphere","structure"])
+    workflow_logger.info(f"Images converted to BIDS: {len(files_info_df)} files, {len(labels_info_df)} labels")
+
+    # store the records in the database, so no second extraction of the sidecars is needed
+    if CONFIG.get('nifti2bids_load', True) and os.path.exists(CONFIG.get('db_path', '')):
+        store_patient_results(patient_results, CONFIG['db_path'])
+    else:
+        workflow_logger.info("Images are not stored in the database, db_path not found or nifti2bids_load disabled.")
+    return files_info_df, bids_info_df, labels_info_df
+
+# columns of the database tables, the sidecar field file_origin has no column
+TABLE_COLUMNS = {"files": ["file_id", "subject_id", "file_path", "file_type"],
+                 "bids": ["file_id", "modality", "protocol_name", "stereotactic", "dicom_image_type", "relative_sidecar_path",
+                          "bids_subject", "bids_session", "bids_extension", "bids_datatype", "bids_acquisition", "bids_suffix"],
+                 "labels": ["file_id", "hemisphere", "structure"]}
+
+def get_table_columns(table_name):
+    """
+    Returns the columns of a database table, with read_nifti_headers the bids table includes the NIFTI_HEADER_COLUMNS.
+    :param table_name: name of the table
+    :return: list of the column names
+    """
+    if table_name == "bids" and CONFIG.get("read_nifti_headers", False):
+        return TABLE_COLUMNS["bids"] + NIFTI_HEADER_COLUMNS
+    return TABLE_COLUMNS[table_name]
+
+def iter_table_rows(patient_results):
+    """
+    Converts the infos of the converted images to table rows, as the transformation of the sidecars does:
+    empty values are NULL, all other values are strings.
+    The files rows come first, since bids and labels reference them.
+    :param patient_results: lists of the files, bids and labels infos of every patient
+    :return: iterator of (table name, row dictionary) tuples
+    """
+    for table_idx, table_name in enumerate(["files", "bids", "labels"]):
+        columns = get_table_columns(table_name)
+        for patient_result in patient_results:
+            for info in patient_result[table_idx]:
+                yield table_name, {column: None if info.get(column) is None or str(info[column]) == '' else str(info[column])
+                                   for column in columns}
+
+def store_patient_results(patient_results, db_path):
+    """
+    Bulk inserts the files, bids and labels rows of all converted images into the database, in one transaction.
+    Rows of images replaced by a new version at the same path are deleted in the same transaction,
+    so a failed insert keeps them (see insert_rows_batched).
+    :param patient_results: lists of the files, bids and labels infos of every patient
+    :param db_path: path of the SQLite database
+    :return: number of inserted rows per table, None if the insert failed
+    """
+    run_id = begin_change_run(db_path)
+    if run_id is not None:
+        workflow_logger.debug(f"Change tracking run: {run_id}")
+    inserted = insert_rows_batched(iter_table_rows(patient_results), db_path, CONFIG.get('load_batch_size', 5000),
+                                   CONFIG.get('load_upsert', False), replace_files=True)
+    if inserted is None:
+        workflow_logger.error("Images could not be stored in the database")
+        return None
+    workflow_logger.info(f"Images stored in the database: {inserted}")
+    return inserted
+
+def create_bids_patient(patientconfig, bids_root_dir, derivatives_patients_dir, forbids_root_dir):
+    """
+    Converts the NIFTI files of one patient to BIDS format.
+    Patients are independent of each other, so they can be converted in parallel processes.
+
+    :param patientconfig: row of the export info of the patient
+    :param bids_root_dir: BIDS root directory
+    :param derivatives_patients_dir: derivatives/Patients directory of the BIDS root directory
+    :param forbids_root_dir: directory with the NIFTI files of all patients
+    :return: lists of the files, bids and labels infos of the patient's images
+    """
+    files_infos = []
+    bids_infos = []
+    labels_infos = []
+
+    # create the subject BIDS directory and the derivatives directory
+    subject_dir = os.path.join(bids_root_dir, f"sub-{patientconfig['bids_id']}")
+    mkdir_if_not_exists(subject_dir)
+    derivatives_subject_dir = os.path.join(derivatives_patients_dir,f"sub-{patientconfig['bids_id']}")
+    mkdir_if_not_exists(derivatives_subject_dir)
+
+    # get the subject NIFTI directory
+    subject_nifti_dir = os.path.join(forbids_root_dir, patientconfig['folder_name'])
+    # the sidecars are written atomically, with sidecar_fsync they are synced to disk in batches
+    with SidecarWriter(fsync=CONFIG.get("sidecar_fsync", False)) as sidecar_writer:
         # iterate over all the NIFTI files in subject NIFTI directory
         for nifti_file in os.listdir(subject_nifti_dir):
-            # increment the image index
-            image_idx += 1
             # get the full path of the NIFTI file
             nifti_file_path = os.path.join(subject_nifti_dir, nifti_file)
             # get the file name
@@ -373,31 +509,25 @@ def NIFTI2BIDS():
             # check if the file type is a MR, CT or Label    
             if nifti_file_type == "MR":
                 #create MR image in BIDS format
-                file_info_dict, bids_info_dict = create_bids_mr_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig)
-                # append the file info to the files_info_df
-                files_info_df = pd.concat([files_info_df, pd.DataFrame(file_info_dict, index=[image_idx])], ignore_index=True)
-                # append the bids info to the bids_info_df
-                bids_info_df = pd.concat([bids_info_df, pd.DataFrame(bids_info_dict, index=[image_idx])], ignore_index=True)
-
+                file_info_dict, bids_info_dict = create_bids_mr_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig, sidecar_writer)
+                files_infos.append(file_info_dict)
+                bids_infos.append(bids_info_dict)
             elif nifti_file_type == "CT":
                 # create CT image in BIDS format
-                file_info_dict, bids_info_dict = create_bids_ct_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig)
-                # append the file info to the files_info_df
-                files_info_df = pd.concat([files_info_df, pd.DataFrame(file_info_dict, index=[image_idx])], ignore_index=True)
-                # append the bids info to the bids_info_df
-                bids_info_df = pd.concat([bids_info_df, pd.DataFrame(bids_info_dict, index=[image_idx])], ignore_index=True)
+                file_info_dict, bids_info_dict = create_bids_ct_image(nifti_file_path, nifti_file_name, subject_dir, patientconfig, sidecar_writer)
+                files_infos.append(file_info_dict)
+                bids_infos.append(bids_info_dict)
             elif nifti_file_type in ["R", "L"]:
                 # create Label image in BIDS format
-                file_info_dict, bids_info_dict, label_info_dict = create_bids_label_image(nifti_file_path, nifti_file_name, derivatives_subject_dir, patientconfig)
-                # append the file info to the files_info_df
-                files_info_df = pd.concat([files_info_df, pd.DataFrame(file_info_dict, index=[image_idx])], ignore_index=True)
-                # append the bids info to the bids_info_df
-                bids_info_df = pd.concat([bids_info_df, pd.DataFrame(bids_info_dict, index=[image_idx])], ignore_index=True)
-                # append the label info to the labels_info_df 
-                labels_info_df = pd.concat([labels_info_df, pd.DataFrame(label_info_dict, index=[image_idx])], ignore_index=True)
+                file_info_dict, bids_info_dict, label_info_dict = create_bids_label_image(nifti_file_path, nifti_file_name, derivatives_subject_dir, patientconfig, sidecar_writer)
+                files_infos.append(file_info_dict)
+                bids_infos.append(bids_info_dict)
+                labels_infos.append(label_info_dict)
             else:
                 logging.warning(f"File type {nifti_file_type} is not defined in the mappings. Skipping file {nifti_file_name}, {nifti_file_path}")
 
+    return files_infos, bids_infos, labels_infos
+
 # Main program
 if __name__ == "__main__":
     """
@@ -2,7 +2,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname((os.path.abspath(__file__))))))
 
-from PyUtilities import read_config_file
+from PyUtilities import read_config_file, copy_file
 import logging
 import pandas as pd
 import os
@@ -110,7 +110,9 @@ def cp_slicer_files_to_bids():
             workflow_logger.error(f"Derivatives directory {derivatives_slicer_dir} already exists")
             continue
         # copy the slicer files to the derivatives directory
-        shutil.copytree(subject_slicer_dir, derivatives_slicer_dir)
+        # the files are copied with the copy strategy of the config file (e.g. reflinks)
+        shutil.copytree(subject_slicer_dir, derivatives_slicer_dir,
+                        copy_function=lambda src, dst: copy_file(src, dst, CONFIG.get("copy_strategy", "auto"), CONFIG.get("copy_hardlink_sources", False)))
         workflow_logger.info(f"Copied Slicer files from {subject_slicer_dir} to {derivatives_slicer_dir}")
 
 # Main program
@@ -10,7 +10,7 @@ root_directory = os.path.abspath(os.path.join(current_script_directory, os.pardi
 # Add the root directory to sys.path
 sys.path.append(root_directory)
 
-from PyUtilities import read_config_file, mkdir_if_not_exists, generate_insert_statement
+from PyUtilities import read_config_file, mkdir_if_not_exists, generate_insert_statement, read_ndjson, write_ndjson
 import pandas as pd
 import concurrent.futures
 import logging
@@ -24,12 +24,15 @@ CONFIG = read_config_file(CONFIG_FILE_PATH)
 def transform_sidecar_data(data: json) -> None:
     """
     Function to transform data of json format to sql queries for a SQLite database.
+    If the load_method of the config file is 'batched', the data is transformed to table rows
+    instead, which are loaded with bound parameters.
     
     Args:
-    data (json): Data to be transformed.
+    data (json): Data to be transformed. Either the extracted dictionary or an iterable of
+                 (relative path, data) tuples, which is transformed lazily one sidecar at a time.
 
     Returns: None
-    Stores: insertSideCarData.sql
+    Stores: insertSideCarData.sql or transformedSideCarData.ndjson
 
     """
     ## CHECKS
@@ -42,7 +45,7 @@ def transform_sidecar_data(data: json) -> None:
         workflow_logger.info("Transformation is skipped as per config file.")
         exit()
     # Check if data is empty
-    if data is None or len(data) == 0:
+    if data is None or (isinstance(data, dict) and len(data) == 0):
         workflow_logger.error("Data is empty, no data will be transformed")
         exit()
     # Check if extraction path exists
@@ -50,6 +53,21 @@ def transform_sidecar_data(data: json) -> None:
         workflow_logger.error(f"Extraction path does not exist: {CONFIG['extraction_path']}")
         exit()
 
+    # Transform data to table rows for the batched loader
+    if CONFIG.get('load_method', 'script') == 'batched':
+        elements = data["sidecardata"].items() if isinstance(data, dict) else data
+        rows = (row for element in elements for row in transform_sidecar_element_rows(element))
+        num_rows = store_transformed_rows(rows)
+        workflow_logger.info(f"Data transformed: {num_rows} table rows")
+        return None
+
+    # Transform streamed data sidecar by sidecar
+    if not isinstance(data, dict):
+        sql_queries = (sql_query for element in data for sql_query in transform_sidecar_element(element))
+        num_queries = store_transformed_queries(sql_queries)
+        workflow_logger.info(f"Data transformed: {num_queries} sql queries")
+        return None
+
     workflow_logger.info(f"Data to be transformed:\n{list(data['sidecardata'])[0:5]}")
 
     # define number of threads
@@ -107,6 +125,61 @@ def transform_sidecar_element(sc_element: json) -> list[str]:
 
     return sql_queries
     
+def transform_sidecar_element_rows(sc_element: json) -> list[tuple]:
+    """
+    Function to transform a element of image data to one or more table rows for a SQLite database.
+    Empty values are converted to NULL, all other values are kept as strings and converted by the
+    column type affinity of the database, as it is done for the generated sql queries.
+
+    Args:
+    sc_element (json): image data to be transformed.
+    
+    Returns: list[tuple]
+    Transformed data as (table name, row dictionary) tuples.
+
+    """
+    # init rows
+    rows = []
+
+    # get the file name and file information
+    file, fileinformation = sc_element
+    workflow_logger.debug(f"Transforming data for file: {file}")
+
+    # assert that the file information is not empty and is a dictionary
+    if fileinformation is None or not isinstance(fileinformation, dict):
+        workflow_logger.error(f"File information is empty or not a dictionary for file: {file}")
+        return rows
+
+    # iterate over the file information and generate the rows
+    for table_name, values in fileinformation.items():
+        row = {column: None if str(value) == '' else str(value) for column, value in values.items()}
+        rows.append((table_name, row))
+
+    return rows
+
+def store_transformed_rows(rows) -> int:
+    """
+    Function to store transformed table rows to a NDJSON file while they are generated.
+    
+    Args:
+    rows (iterable): Transformed (table name, row dictionary) tuples to be stored.
+
+    Returns: int
+    Number of stored rows.
+    Stores: transformedSideCarData.ndjson
+
+    """
+    # mkdir "data" if not exists
+    data_dir = os.path.join(CONFIG['extraction_path'])
+    mkdir_if_not_exists(data_dir)
+
+    # Save transformed rows to a NDJSON file
+    data_file = os.path.join(data_dir, 'transformedSideCarData.ndjson')
+    num_rows = write_ndjson(data_file, ({'table': table_name, 'row': row} for table_name, row in rows))
+
+    workflow_logger.debug(f"Transformed data stored successfully, path: {data_file}")
+    return num_rows
+
 def store_transformed_data(data: pd.DataFrame) -> None:
     """
     Function to store transformed data to a sql file.
@@ -131,6 +204,34 @@ def store_transformed_data(data: pd.DataFrame) -> None:
 
     workflow_logger.debug(f"Transformed data stored successfully, path: {data_file}")
 
+def store_transformed_queries(sql_queries) -> int:
+    """
+    Function to store transformed sql queries to a sql file while they are generated.
+    
+    Args:
+    sql_queries (iterable): Transformed sql queries to be stored.
+
+    Returns: int
+    Number of stored sql queries.
+    Stores: insertSideCarData.sql
+
+    """
+    # mkdir "data" if not exists
+    data_dir = os.path.join(CONFIG['extraction_path'])
+    mkdir_if_not_exists(data_dir)
+
+    # Save transformed data to a sql file
+    num_queries = 0
+    data_file = os.path.join(data_dir, 'insertSideCarData.sql')
+    with open(data_file, 'w') as file:
+        for sql_query in sql_queries:
+            file.write(sql_query)
+            file.write('\n')
+            num_queries += 1
+
+    workflow_logger.debug(f"Transformed data stored successfully, path: {data_file}")
+    return num_queries
+
 if __name__ == '__main__':
     # Set up logger
     workflow_logger = logging.getLogger('workflow_logger')
@@ -144,9 +245,16 @@ if __name__ == '__main__':
     # Extract data
     data_dir = os.path.join(CONFIG['extraction_path'])
     # Define the path to load the extracted data
-    data_file = os.path.join(data_dir, 'extracted_data.json')
+    if CONFIG.get('extraction_format', 'json') == 'ndjson':
+        data_file = os.path.join(data_dir, 'extracted_data.ndjson')
+    else:
+        data_file = os.path.join(data_dir, 'extracted_data.json')
     if not os.path.exists(data_file):
         workflow_logger.error(f"Extracted data file does not exist: {data_file}")
         exit()
-    data = json.load(open(data_file))
+    if CONFIG.get('extraction_format', 'json') == 'ndjson':
+        # read the extracted data lazily, one sidecar at a time
+        data = ((record['sidecar'], record['sidecardata']) for record in read_ndjson(data_file))
+    else:
+        data = json.load(open(data_file))
     transform_sidecar_data(data)
\ No newline at end of file
@@ -41,10 +41,8 @@ class HashGenThread(QThread):
     def run(self):
         global source_ids
         total_files = len(self.files)
-        # Perform the hash calculation 
-        for idx, file in enumerate(self.files):
-            # Calculate hash for the file (simulate a long-running task)
-            source_id = gf.calculate_hash(file)
+        # Perform the hash calculation, several files are hashed concurrently
+        for idx, source_id in enumerate(gf.iter_hashes(self.files, num_workers=gf.HASH_WORKERS)):
             source_ids.append(source_id)
             # Update the progress bar by emitting the current progress (percentage of completed files)
             self.progress.emit(int((idx + 1) / total_files * 100))  # Progress percentage
@@ -652,11 +652,11 @@ class BIDSConverter(QWidget):
                     bids_files_list.remove(new_path)
                     continue
                 else:
-                    shutil.copy2(old_path, new_path)
+                    gf.copy_file(old_path, new_path)
                     moved_files = moved_files + 1
             else:
-                # Move the file from old_path to new_path
-                shutil.copy2(old_path, new_path)
+                # Copy the file from old_path to new_path (reflinked if the file system supports it)
+                gf.copy_file(old_path, new_path)
                 moved_files = moved_files + 1
         # If at least one file has been moved generate success dialog and enable passing to json generator.
         # The file paths passed to the json generator are only the ones for which moving was allowed by the user
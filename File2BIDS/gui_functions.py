@@ -1,6 +1,14 @@
 import json
 import os
-import hashlib
+import sys
+import logging
+
+# The file hashing and copying is shared with the ETL: the executables vendor PyUtilities/fileFunctions.py at build time,
+# when run from the repository it is imported from the PyUtilities folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "PyUtilities"))
+from fileFunctions import set_hash_cache, calculate_hash, iter_hashes, copy_file
+
+logger = logging.getLogger(__name__)
 
 # Dictionary mapping the file extension to the datatype
 data_dict = {
@@ -143,30 +151,13 @@ def extract_info_from_filename(file, is_label=False, is_transformed = False):
     
     return info_dict
 
-def calculate_hash(filename, hash_type="sha256"):
-  """
-  Calculates the hash of a file.
- 
-  Args:
-    filename: The path to the file.
-    hash_type: The type of hash algorithm to use (e.g., "md5", "sha256", "sha1").
- 
-  Returns:
-    The hash of the file as a hexadecimal string.
-  """
-  
-  # Open the file in binary mode
-  with open(filename, "rb") as f:
-    # Create a hash object
-    hasher = hashlib.new(hash_type)
-    
-    # Read the file in chunks and update the hash
-    chunk_size = 4096  # You can adjust this value based on your needs
-    while True:
-      chunk = f.read(chunk_size)
-      if not chunk:
-        break
-      hasher.update(chunk)
-    
-    # Return the hash as a hexadecimal string
-    return hasher.hexdigest()
\ No newline at end of file
+# Persistent cache of file hashes, keyed by device, inode, size and modification time of the file
+HASH_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "File2BIDS", "hash_cache.db")
+# Number of files hashed concurrently by HashGenThread
+HASH_WORKERS = 4
+
+try:
+  os.makedirs(os.path.dirname(HASH_CACHE_PATH), exist_ok=True)
+  set_hash_cache(HASH_CACHE_PATH)
+except OSError as e:
+  logger.error(f"Hash cache could not be created, hashes are not cached: {HASH_CACHE_PATH}: {e}")
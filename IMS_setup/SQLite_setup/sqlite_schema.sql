@@ -21,6 +21,14 @@ CREATE TABLE
      , dicom_image_type TEXT
      , acquisition_date_time TEXT
      , relative_sidecar_path TEXT
+     , image_dimensions TEXT
+     , voxel_sizes TEXT
+     , image_datatype TEXT
+     , qform_code INTEGER
+     , qform TEXT
+     , sform_code INTEGER
+     , sform TEXT
+     , image_description TEXT
      , bids_subject TEXT NOT NULL
      , bids_session TEXT NOT NULL
      , bids_extension TEXT NOT NULL
@@ -53,4 +61,126 @@ CREATE TABLE
      , CONSTRAINT fk_transformations_images_2 FOREIGN KEY (target_id) REFERENCES files (file_id)
      , CONSTRAINT fk_transformations_transformations_1 FOREIGN KEY (transform_id) REFERENCES files (file_id)
      , UNIQUE (target_id, transform_id)
-     );
\ No newline at end of file
+     );
+
+CREATE TABLE 
+       sync_state 
+     ( name TEXT NOT NULL
+     , value INTEGER NOT NULL
+     , PRIMARY KEY (name)
+     );
+
+INSERT INTO sync_state (name, value) VALUES ('run_id', 0);
+
+CREATE TABLE 
+       change_log 
+     ( change_id INTEGER PRIMARY KEY AUTOINCREMENT
+     , file_id TEXT NOT NULL
+     , table_name TEXT NOT NULL
+     , operation TEXT NOT NULL
+     , run_id INTEGER NOT NULL
+     );
+
+-- the triggers of the transformations table look up the files by transformation_id
+CREATE INDEX 
+       files_transformation_id 
+       ON files (transformation_id);
+
+CREATE TRIGGER 
+       files_insert_change_log 
+       AFTER INSERT ON files 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (NEW.file_id, 'files', 'INSERT', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       files_update_change_log 
+       AFTER UPDATE ON files 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (NEW.file_id, 'files', 'UPDATE', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       files_delete_change_log 
+       AFTER DELETE ON files 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (OLD.file_id, 'files', 'DELETE', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       bids_insert_change_log 
+       AFTER INSERT ON bids 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (NEW.file_id, 'bids', 'INSERT', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       bids_update_change_log 
+       AFTER UPDATE ON bids 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (NEW.file_id, 'bids', 'UPDATE', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       bids_delete_change_log 
+       AFTER DELETE ON bids 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (OLD.file_id, 'bids', 'DELETE', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       labels_insert_change_log 
+       AFTER INSERT ON labels 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (NEW.file_id, 'labels', 'INSERT', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       labels_update_change_log 
+       AFTER UPDATE ON labels 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (NEW.file_id, 'labels', 'UPDATE', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       labels_delete_change_log 
+       AFTER DELETE ON labels 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       VALUES (OLD.file_id, 'labels', 'DELETE', (SELECT value FROM sync_state WHERE name = 'run_id'));
+END;
+
+CREATE TRIGGER 
+       transformations_insert_change_log 
+       AFTER INSERT ON transformations 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       SELECT file_id, 'transformations', 'INSERT', (SELECT value FROM sync_state WHERE name = 'run_id') 
+       FROM files WHERE transformation_id = NEW.transformation_id OR file_id IN (NEW.target_id, NEW.transform_id);
+END;
+
+CREATE TRIGGER 
+       transformations_update_change_log 
+       AFTER UPDATE ON transformations 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       SELECT file_id, 'transformations', 'UPDATE', (SELECT value FROM sync_state WHERE name = 'run_id') 
+       FROM files WHERE transformation_id = NEW.transformation_id OR file_id IN (NEW.target_id, NEW.transform_id);
+END;
+
+CREATE TRIGGER 
+       transformations_delete_change_log 
+       AFTER DELETE ON transformations 
+BEGIN
+       INSERT INTO change_log (file_id, table_name, operation, run_id) 
+       SELECT file_id, 'transformations', 'DELETE', (SELECT value FROM sync_state WHERE name = 'run_id') 
+       FROM files WHERE transformation_id = OLD.transformation_id OR file_id IN (OLD.target_id, OLD.transform_id);
+END;
\ No newline at end of file
@@ -3,6 +3,7 @@ import re
 import os
 import pandas as pd
 import logging
+from PyUtilities.databaseFunctions import connect_database, get_active_session
 
 # Configure logger
 workflow_logger = logging.getLogger('workflow_logger')
@@ -32,7 +33,7 @@ def create_database(database_name, database_sql ,wipe=False):
         
     try:
         # Create a connection to the database
-        conn = sqlite3.connect(database_name)
+        conn = connect_database(database_name)
 
         # Create a cursor object to interact with the database
         cursor = conn.cursor()
@@ -69,7 +70,7 @@ def wipe_sqlite_database(db_name):
 
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_name)
+        conn = connect_database(db_name)
         cursor = conn.cursor()
 
         # Get all table names
@@ -94,28 +95,31 @@ def wipe_sqlite_database(db_name):
         # Close the database connection
         conn.close()
 
-def execute_sql_statement(sql_statement, db_file):
+def execute_sql_statement(sql_statement, db_file, params=()):
     """
     :param db_file: complete file path to db
     :param sql_statement: sql statement to select, insert, update or delete row
+    :param params: optional parameters bound to the ? placeholders of the statement
     :return: None or the result of the query
     """
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
+    # Connect to the SQLite database, reuse the connection of an active session
+    session = get_active_session(db_file)
+    conn = session.connection() if session is not None else connect_database(db_file)
     cursor = conn.cursor()
 
     try:
         # Execute the SQL statement
-        cursor.execute(sql_statement)
+        cursor.execute(sql_statement, params)
 
         # If the statement is a query, fetch all rows
-        if sql_statement.strip().lower().startswith("select"):
+        if sql_statement.strip().lower().startswith("select") or sql_statement.strip().lower().startswith("pragma"):
             rows = cursor.fetchall()
             return rows
 
         # If the statement is an update, delete, or insert, commit the changes
         else:
-            conn.commit()
+            if session is None or session.autocommit:
+                conn.commit()
             workflow_logger.debug(f"Statement:{sql_statement}: ran successfully")
             return "Statement executed successfully."
 
@@ -124,9 +128,10 @@ def execute_sql_statement(sql_statement, db_file):
         return f"Statement:{sql_statement}: failed: {e}"
 
     finally:
-        # Close the database connection
+        # Close the database connection (connections of a session are closed with the session)
         cursor.close()
-        conn.close()
+        if session is None:
+            conn.close()
 
 def execute_sql_script(sql_script, db_file):
     """
@@ -139,8 +144,9 @@ def execute_sql_script(sql_script, db_file):
     Returns:
     None
     """
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
+    # Connect to the SQLite database, reuse the connection of an active session
+    session = get_active_session(db_file)
+    conn = session.connection() if session is not None else connect_database(db_file)
     cursor = conn.cursor()
 
     try:
@@ -154,9 +160,10 @@ def execute_sql_script(sql_script, db_file):
         return e
 
     finally:
-        # Close the database connection
+        # Close the database connection (connections of a session are closed with the session)
         cursor.close()
-        conn.close()
+        if session is None:
+            conn.close()
 
 # Data check Function
 def data_check(db_file):
@@ -167,7 +174,7 @@ def data_check(db_file):
     :return: None
     """
     # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
+    conn = connect_database(db_file)
     
     # Create a cursor object
     cursor = conn.cursor()
@@ -212,6 +219,10 @@ def get_db_dict(db_path):
     tables_dict (dict): a dictionary where keys are table names, and values are lists containing the column names associated with each table in the SQLite database
     """
 
+    # Within a session the schema is read only once
+    session = get_active_session(db_path)
+    if session is not None and 'tables_dict' in session.schema_cache:
+        return session.schema_cache['tables_dict']
     # Dictionary to store table names and their columns
     tables_dict = {}
     # Generate statement 
@@ -237,6 +248,8 @@ def get_db_dict(db_path):
             # Add the table and its columns to the dictionary
             tables_dict[table_name] = columns
 
+    if session is not None:
+        session.schema_cache['tables_dict'] = tables_dict
     return tables_dict
 
 def gen_join_statement(tables, attributes, join_type):
@@ -276,10 +289,10 @@ def get_db_row(table_name, values, database_path, attribute, compare_signs):
     'NA' + False: if row doesn't exist
     """
     # Generate query
-    query = gen_select_statement(table_name, values, database_path, attribute, compare_signs)
+    query = gen_select_statement(table_name, values, attribute, compare_signs)
     
-    # Fetch the result(s)
-    result = execute_sql_statement(query, database_path)
+    # Fetch the result(s), the values are bound to the ? placeholders of the query
+    result = execute_sql_statement(query, database_path, tuple(values.values()))
 
     # Check if a row exists
     if result:
@@ -336,12 +349,19 @@ def get_primary_keys(table_name, database_path):
     If there are multiple primary keys (composite primary key), the list will contain multiple column names. If no primary keys are found, the function returns an empty list. 
     """
 
+    # Within a session the primary keys of a table are read only once
+    session = get_active_session(database_path)
+    if session is not None and ('primary_keys', table_name) in session.schema_cache:
+        return session.schema_cache[('primary_keys', table_name)]
+
     # Query the sqlite_master table to get information about the table
     query = f"PRAGMA table_info({table_name});"
     table_info = execute_sql_statement(query, database_path)
     # Find columns that have the 'pk' flag (primary key)
     primary_keys = [column[1] for column in table_info if column[5]]
 
+    if session is not None:
+        session.schema_cache[('primary_keys', table_name)] = primary_keys
     return primary_keys
 
 def get_max_from_table(table_name, column, database_path):
@@ -358,9 +378,10 @@ def get_max_from_table(table_name, column, database_path):
     max (int): maximum value extracted from table
     """
     
+    # Connect to the SQLite database, reuse the connection of an active session
+    session = get_active_session(database_path)
+    connection = session.connection() if session is not None else connect_database(database_path)
     try:
-       # Connect to the SQLite database
-        connection = sqlite3.connect(database_path)
         cursor = connection.cursor() 
         query = 'SELECT MAX(' + column + ') FROM ' +table_name
         cursor.execute(query)
@@ -372,8 +393,9 @@ def get_max_from_table(table_name, column, database_path):
     except sqlite3.Error as e:
         print("Error:", e)
     finally:
-        # Close the database connection
-        connection.close()
+        # Close the database connection (connections of a session are closed with the session)
+        if session is None:
+            connection.close()
 
 
 def gen_insert_or_update_statement(table_name, data, database_path):
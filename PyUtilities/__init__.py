@@ -1,4 +1,8 @@
 from .setupFunctions import read_config_file
 from .edit_add_bids_templates import copy_templates_to_bids_root, add_participants_ids_to_tsv, change_dataset_name
-from .utility_functions import mkdir_if_not_exists, calculate_hash
-from .databaseFunctions import wipe_sqlite_database, generate_insert_statement
\ No newline at end of file
+from .read_write import read_ndjson, write_ndjson, index_ndjson, read_ndjson_record
+from .utility_functions import mkdir_if_not_exists, copy_and_hash, copy_and_hash_if_changed, compress_and_hash, compress_and_hash_if_changed, scan_files, get_relative_path, get_sidecar_path
+from .fileFunctions import set_hash_cache, calculate_hash, hash_files, copy_file
+from .niftiHeaderFunctions import read_nifti_header, try_read_nifti_header, NIFTI_HEADER_COLUMNS
+from .databaseFunctions import wipe_sqlite_database, generate_insert_statement, DatabaseSession
+from .manifestFunctions import read_manifest, write_manifest, commit_manifest, diff_manifest, hash_content, MANIFEST_FILE_NAME, PENDING_MANIFEST_FILE_NAME
\ No newline at end of file
@@ -3,10 +3,212 @@ import re
 import os
 import pandas as pd
 import logging
+import threading
+from contextlib import contextmanager
 
 # Configure logger
 workflow_logger = logging.getLogger('workflow_logger')
 
+# SQLite connection profiles (PRAGMA name -> value) applied to every connection
+# safe: durable commits for normal operation, WAL lets readers work while the database is written
+# bulk: no fsyncs and larger caches for load runs, a crash of the OS during the load may corrupt the database
+CONNECTION_PROFILES = {
+    "safe": {"journal_mode": "WAL", "synchronous": "FULL", "busy_timeout": 5000, "cache_size": -16000,
+             "mmap_size": 268435456, "temp_store": "MEMORY"},
+    "bulk": {"journal_mode": "WAL", "synchronous": "OFF", "busy_timeout": 5000, "cache_size": -256000,
+             "mmap_size": 1073741824, "temp_store": "MEMORY"},
+}
+connection_pragmas = dict(CONNECTION_PROFILES["safe"])
+
+def set_connection_profile(profile="safe", pragmas=None):
+    """
+    This function sets the PRAGMAs applied to every new SQLite connection.
+
+    Args:
+    profile (str): The name of the connection profile (see CONNECTION_PROFILES).
+    pragmas (dict): PRAGMA values overriding the ones of the profile (e.g. {"journal_mode": "DELETE"}).
+
+    Returns:
+    dict: The PRAGMAs used before, to restore them later.
+    """
+    global connection_pragmas
+    if profile not in CONNECTION_PROFILES:
+        workflow_logger.error(f"Unknown connection profile: {profile}, using safe profile")
+        profile = "safe"
+    previous_pragmas = connection_pragmas
+    connection_pragmas = {**CONNECTION_PROFILES[profile], **(pragmas or {})}
+    workflow_logger.debug(f"Connection profile {profile}: {connection_pragmas}")
+    return previous_pragmas
+
+@contextmanager
+def connection_profile(profile, pragmas=None):
+    """
+    This context manager applies a connection profile for the connections opened within, e.g. during a bulk load.
+
+    Args:
+    profile (str): The name of the connection profile (see CONNECTION_PROFILES).
+    pragmas (dict): PRAGMA values overriding the ones of the profile.
+    """
+    global connection_pragmas
+    previous_pragmas = set_connection_profile(profile, pragmas)
+    try:
+        yield
+    finally:
+        connection_pragmas = previous_pragmas
+
+def connect_database(db_file, check_same_thread=True):
+    """
+    This function opens a SQLite connection with the PRAGMAs of the current connection profile.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+    check_same_thread (bool): If False, the connection may be closed by another thread than the one which opened it.
+
+    Returns:
+    sqlite3.Connection: The connection.
+    """
+    conn = sqlite3.connect(db_file, check_same_thread=check_same_thread)
+    # busy_timeout first, so that changing the journal mode waits for other connections
+    for pragma, value in sorted(connection_pragmas.items(), key=lambda item: item[0] != "busy_timeout"):
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+# Sessions entered with "with DatabaseSession(...)", by absolute database path
+active_sessions = {}
+active_sessions_lock = threading.Lock()
+
+class DatabaseSession:
+    """
+    Context manager sharing SQLite connections between the database helper functions.
+    Within the session, the helpers of this module (execute_sql_statement, insert_rows_batched, the change log
+    functions, ...) and of AdditionalDatabaseFunctions reuse one connection per thread instead of opening and
+    closing a connection for every call, and the table schemas are read only once.
+    Without autocommit, a helper which fails rolls back all uncommitted statements of the session.
+
+    Example:
+    with DatabaseSession(db_path):
+        for row in rows:
+            exists, query = gen_insert_or_update_statement("files", row, db_path)
+            execute_sql_statement(query, db_path)
+
+    Args:
+    db_file (str): The path to the SQLite database.
+    autocommit (bool): If True every statement is committed (as without session),
+                       otherwise all statements are committed when the session ends without error.
+    """
+
+    def __init__(self, db_file, autocommit=True):
+        self.db_file = db_file
+        self.autocommit = autocommit
+        self.schema_cache = {}
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """
+        Returns the connection of the calling thread, it is opened on first use.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect_database(self.db_file, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self, commit=True):
+        """
+        Commits (or rolls back) and closes the connections of all threads.
+        """
+        with self._lock:
+            for conn in self._connections:
+                if commit:
+                    conn.commit()
+                else:
+                    conn.rollback()
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def __enter__(self):
+        with active_sessions_lock:
+            active_sessions.setdefault(os.path.abspath(self.db_file), []).append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with active_sessions_lock:
+            active_sessions[os.path.abspath(self.db_file)].remove(self)
+        self.close(commit=exc_type is None)
+        return False
+
+def get_active_session(db_file):
+    """
+    This function returns the innermost active DatabaseSession of a database.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+
+    Returns:
+    DatabaseSession: The session or None if no session is active.
+    """
+    sessions = active_sessions.get(os.path.abspath(db_file))
+    return sessions[-1] if sessions else None
+
+def open_connection(db_file):
+    """
+    This function returns the connection of the active DatabaseSession of a database, or else a new connection.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+
+    Returns:
+    sqlite3.Connection: The connection, to be released with close_connection.
+    DatabaseSession: The session or None if the connection is new.
+    """
+    session = get_active_session(db_file)
+    return (session.connection() if session is not None else connect_database(db_file)), session
+
+def commit_connection(conn, session):
+    # within a session without autocommit, the statements are committed when the session ends
+    if session is None or session.autocommit:
+        conn.commit()
+
+def close_connection(conn, session):
+    # connections of a session are closed with the session
+    if session is None:
+        conn.close()
+
+def iter_sql_statements(sql_script):
+    """
+    This function splits an SQL script into its statements (a ; within a string or trigger does not end a statement).
+
+    Args:
+    sql_script (str): The SQL script.
+
+    Returns:
+    iterator: The statements.
+    """
+    statement = ""
+    for part in sql_script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+def create_database_engine(db_file):
+    """
+    This function creates a SQLAlchemy engine whose connections use the current connection profile.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+
+    Returns:
+    sqlalchemy.engine.Engine: The engine.
+    """
+    from sqlalchemy import create_engine
+    return create_engine("sqlite://", creator=lambda: connect_database(db_file))
+
 def create_database(database_name, database_sql ,wipe=False):
     """
     This function creates a new SQLite database using the provided SQL schema.
@@ -32,7 +234,7 @@ def create_database(database_name, database_sql ,wipe=False):
         
     try:
         # Create a connection to the database
-        conn = sqlite3.connect(database_name)
+        conn = connect_database(database_name)
 
         # Create a cursor object to interact with the database
         cursor = conn.cursor()
@@ -69,7 +271,7 @@ def wipe_sqlite_database(db_name):
 
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_name)
+        conn = connect_database(db_name)
         cursor = conn.cursor()
 
         # Get all table names
@@ -146,28 +348,29 @@ def generate_search_statement(searched_attribute,table,attributes,redcapvalues):
     sql_statement += ")"
     return fix_sql_query(sql_statement)
 
-def execute_sql_statement(sql_statement, db_file):
+def execute_sql_statement(sql_statement, db_file, params=()):
     """
     :param db_file: complete file path to db
     :param sql_statement: insert statement creating the new entry if it doesn't exist yet
+    :param params: optional parameters bound to the ? placeholders of the statement
     :return: None or the result of the query
     """
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
     cursor = conn.cursor()
 
     try:
         # Execute the SQL statement
-        cursor.execute(sql_statement)
+        cursor.execute(sql_statement, params)
 
         # If the statement is a query, fetch all rows
-        if sql_statement.strip().lower().startswith("select"):
+        if sql_statement.strip().lower().startswith("select") or sql_statement.strip().lower().startswith("pragma"):
             rows = cursor.fetchall()
             return rows
 
         # If the statement is an update, delete, or insert, commit the changes
         else:
-            conn.commit()
+            commit_connection(conn, session)
             workflow_logger.debug(f"Statement:{sql_statement}: ran successfully")
             return "Statement executed successfully."
 
@@ -176,9 +379,9 @@ def execute_sql_statement(sql_statement, db_file):
         return f"Statement:{sql_statement}: failed: {e}"
 
     finally:
-        # Close the database connection
+        # Close the database connection (connections of a session are closed with the session)
         cursor.close()
-        conn.close()
+        close_connection(conn, session)
 
 def execute_sql_script(sql_script, db_file):
     """
@@ -191,24 +394,396 @@ def execute_sql_script(sql_script, db_file):
     Returns:
     None
     """
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
     cursor = conn.cursor()
 
     try:
         # Execute the SQL script
-        cursor.executescript(sql_script)
-        conn.commit()
+        if session is None or session.autocommit:
+            cursor.executescript(sql_script)
+            conn.commit()
+        else:
+            # executescript commits the pending transaction first, so the statements of a session
+            # without autocommit are executed one by one
+            for statement in iter_sql_statements(sql_script):
+                cursor.execute(statement)
         return "successfully."
 
     except sqlite3.Error as e:
-        workflow_logger.exception("SQL script execution failed:", e)
+        # without autocommit, the statements of the failed script must not be committed with the session
+        conn.rollback()
+        workflow_logger.exception(f"SQL script execution failed: {e}")
         return e
 
     finally:
-        # Close the database connection
+        # Close the database connection (connections of a session are closed with the session)
         cursor.close()
-        conn.close()
+        close_connection(conn, session)
+
+def get_primary_keys(cursor, table_name):
+    """
+    This function returns the primary key columns of a table, in key order.
+
+    Args:
+    cursor (sqlite3.Cursor): A cursor of the database.
+    table_name (str): The name of the table.
+
+    Returns:
+    list: The primary key columns with their declared types, as (column, type) tuples.
+    """
+    cursor.execute(f"PRAGMA table_info({table_name});")
+    # column: (cid, name, type, notnull, default, pk)
+    return [(column[1], column[2]) for column in sorted(cursor.fetchall(), key=lambda column: column[5]) if column[5]]
+
+def get_conflict_columns(cursor, table_name, columns, null_primary_key=False):
+    """
+    This function returns the key columns identifying an existing row of a table,
+    i.e. the primary key or else the first unique index whose columns are all given.
+    A unique index (the natural key, e.g. target_id, transform_id of the transformations) is preferred, if the
+    primary key is a surrogate INTEGER PRIMARY KEY or a row has a NULL primary key value: such a row never
+    conflicts on the primary key, but would violate the unique index.
+
+    Args:
+    cursor (sqlite3.Cursor): A cursor of the database.
+    table_name (str): The name of the table.
+    columns (tuple): The columns of the rows to be inserted.
+    null_primary_key (bool): True if a primary key value of the rows is NULL.
+
+    Returns:
+    list: The key columns, None if no key is covered by the given columns.
+    """
+    primary_key_types = get_primary_keys(cursor, table_name)
+    primary_keys = [key for key, _ in primary_key_types]
+    covers_primary_key = bool(primary_keys) and all(key in columns for key in primary_keys)
+    surrogate_key = len(primary_key_types) == 1 and primary_key_types[0][1].upper() == "INTEGER"
+    if covers_primary_key and not surrogate_key and not null_primary_key:
+        return primary_keys
+    cursor.execute(f"PRAGMA index_list({table_name});")
+    for index in cursor.fetchall():
+        # index: (seq, name, unique, origin, partial)
+        if not index[2] or index[4] or index[3] == "pk":
+            continue
+        cursor.execute(f"PRAGMA index_info({index[1]});")
+        keys = [column[2] for column in cursor.fetchall()]
+        if keys and keys != primary_keys and all(key in columns for key in keys):
+            return keys
+    return primary_keys if covers_primary_key else None
+
+def generate_upsert_statement(table_name, columns, conflict_columns, primary_keys=()):
+    """
+    This function generates an upsert statement with ? placeholders for a given table and columns.
+    An existing row with the same key is updated, but only if one of its values differs,
+    so that unchanged rows are not written again.
+
+    Args:
+    table_name (str): The name of the table.
+    columns (tuple): The columns of the rows to be inserted.
+    conflict_columns (list): The key columns identifying an existing row.
+    primary_keys (list): The primary key columns, they are not updated if the row is identified by another key.
+
+    Returns:
+    str: The upsert statement.
+    """
+    insert_statement = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    update_columns = [column for column in columns if column not in conflict_columns and column not in primary_keys]
+    if not update_columns:
+        return f"{insert_statement} ON CONFLICT({', '.join(conflict_columns)}) DO NOTHING;"
+    set_clause = ', '.join(f"{column} = excluded.{column}" for column in update_columns)
+    # IS NOT compares NULL values as equal values
+    where_clause = ' OR '.join(f"{table_name}.{column} IS NOT excluded.{column}" for column in update_columns)
+    return f"{insert_statement} ON CONFLICT({', '.join(conflict_columns)}) DO UPDATE SET {set_clause} WHERE {where_clause};"
+
+def insert_rows_batched(rows, db_file, batch_size=5000, upsert=False, replace_files=False):
+    """
+    This function inserts table rows into a SQLite database with bound parameters.
+    The rows are grouped by table (and column set) and inserted with executemany in batches,
+    all inside one transaction. Rows with an existing primary key are ignored (INSERT OR IGNORE),
+    or, if upsert is True, updated where their values changed (INSERT ... ON CONFLICT DO UPDATE).
+    With upsert or replace_files, a files row with a known file_path but a new file_id (e.g. a re-hashed image)
+    replaces the old version: the rows of the old file_id are deleted first, in the same transaction
+    (see delete_replaced_file_rows), otherwise the unique file_path would make the whole load fail
+    (or, without upsert, the new version would be ignored).
+
+    Args:
+    rows (iterable): (table name, row dictionary) tuples, consumed lazily.
+    db_file (str): The path to the SQLite database.
+    batch_size (int): The number of rows of one group inserted with one executemany call.
+    upsert (bool): If True, existing rows are updated instead of ignored.
+    replace_files (bool): If True, replaced files are deleted also without upsert.
+
+    Returns:
+    dict: The number of inserted (or updated) rows per table, None if the transaction failed.
+    """
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
+    cursor = conn.cursor()
+
+    batches = {}
+    inserted = {}
+    statements = {}
+
+    def get_statement(table_name, columns, null_primary_key):
+        conflict_columns = get_conflict_columns(cursor, table_name, columns, null_primary_key) if upsert else None
+        if conflict_columns is None:
+            if upsert:
+                workflow_logger.warning(f"No key of table {table_name} in columns {columns}, rows are inserted with INSERT OR IGNORE")
+            return f"INSERT OR IGNORE INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        primary_keys = [key for key, _ in get_primary_keys(cursor, table_name)]
+        return generate_upsert_statement(table_name, columns, conflict_columns, primary_keys if conflict_columns != primary_keys else ())
+
+    def flush(table_name, columns):
+        values = batches.pop((table_name, columns))
+        if (upsert or replace_files) and table_name == "files" and "file_path" in columns and "file_id" in columns:
+            path_idx, id_idx = columns.index("file_path"), columns.index("file_id")
+            replaced = delete_replaced_file_rows(cursor, ((value[path_idx], value[id_idx]) for value in values))
+            if replaced["files"]:
+                workflow_logger.info(f"Replaced files deleted: {replaced}")
+        null_primary_key = False
+        if upsert:
+            # rows with a NULL primary key (e.g. an empty transformation_id of a sidecar) are identified by another key
+            key_idxs = [columns.index(key) for key, _ in get_primary_keys(cursor, table_name) if key in columns]
+            null_primary_key = any(value[idx] is None for value in values for idx in key_idxs)
+        if (table_name, columns, null_primary_key) not in statements:
+            statements[(table_name, columns, null_primary_key)] = get_statement(table_name, columns, null_primary_key)
+        cursor.executemany(statements[(table_name, columns, null_primary_key)], values)
+        inserted[table_name] = inserted.get(table_name, 0) + max(cursor.rowcount, 0)
+
+    try:
+        # Group the rows by table and columns and insert full batches
+        for table_name, row in rows:
+            key = (table_name, tuple(row.keys()))
+            batches.setdefault(key, []).append(tuple(row.values()))
+            if len(batches[key]) >= batch_size:
+                flush(*key)
+        # Insert the remaining rows
+        for key in list(batches):
+            flush(*key)
+        commit_connection(conn, session)
+        workflow_logger.debug(f"Rows inserted: {inserted}")
+        return inserted
+
+    except sqlite3.Error as e:
+        conn.rollback()
+        workflow_logger.error(f"Batched insert failed, transaction rolled back: {e}")
+        return None
+
+    finally:
+        # Close the database connection (connections of a session are closed with the session)
+        cursor.close()
+        close_connection(conn, session)
+
+def update_column_values(db_file, table_name, key_column, column, values):
+    """
+    This function updates one column of a table in place, for the rows identified by a key column.
+    The new values are joined from a temporary table and only rows whose value changes are written,
+    so the table definition (keys, constraints and indexes) is kept.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+    table_name (str): The name of the table.
+    key_column (str): The column identifying the rows, e.g. the primary key.
+    column (str): The column to be updated.
+    values (iterable): (key, new value) tuples.
+
+    Returns:
+    int: The number of updated rows, None if the transaction failed.
+    """
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("DROP TABLE IF EXISTS temp.column_values;")
+        cursor.execute("CREATE TEMP TABLE column_values (key PRIMARY KEY, value);")
+        cursor.executemany("INSERT OR REPLACE INTO column_values (key, value) VALUES (?, ?)", values)
+        # IS NOT compares NULL values as equal values
+        cursor.execute(f"""UPDATE {table_name} SET {column} = column_values.value FROM column_values
+                           WHERE {table_name}.{key_column} = column_values.key
+                           AND {table_name}.{column} IS NOT column_values.value;""")
+        updated = max(cursor.rowcount, 0)
+        cursor.execute("DROP TABLE column_values;")
+        commit_connection(conn, session)
+        workflow_logger.debug(f"Column {table_name}.{column} updated: {updated} rows")
+        return updated
+
+    except sqlite3.Error as e:
+        conn.rollback()
+        workflow_logger.error(f"Column {table_name}.{column} could not be updated, transaction rolled back: {e}")
+        return None
+
+    finally:
+        # Close the database connection (connections of a session are closed with the session)
+        cursor.close()
+        close_connection(conn, session)
+
+def delete_orphaned_files(db_file, file_ids):
+    """
+    This function deletes the rows of all files which are not in the given set of file_ids,
+    i.e. whose sidecar was removed from the BIDS directory.
+    The rows referencing a file are deleted before the file itself (transformations, labels, bids, files),
+    all inside one transaction.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+    file_ids (iterable): The file_ids of all current sidecars.
+
+    Returns:
+    dict: The number of deleted rows per table, None if the transaction failed.
+    """
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
+    cursor = conn.cursor()
+
+    # Tables in foreign key safe order, with the columns referencing files.file_id
+    tables = [("transformations", ["target_id", "transform_id"]),
+              ("labels", ["file_id"]),
+              ("bids", ["file_id"]),
+              ("files", ["file_id"])]
+    deleted = {}
+
+    try:
+        cursor.execute("DROP TABLE IF EXISTS temp.current_file_ids;")
+        cursor.execute("CREATE TEMP TABLE current_file_ids (file_id TEXT PRIMARY KEY);")
+        cursor.executemany("INSERT OR IGNORE INTO current_file_ids (file_id) VALUES (?)", ((file_id,) for file_id in file_ids))
+        for table_name, columns in tables:
+            where_clause = ' OR '.join(f"{column} NOT IN (SELECT file_id FROM current_file_ids)" for column in columns)
+            cursor.execute(f"DELETE FROM {table_name} WHERE {where_clause};")
+            deleted[table_name] = max(cursor.rowcount, 0)
+        cursor.execute("DROP TABLE current_file_ids;")
+        commit_connection(conn, session)
+        workflow_logger.debug(f"Orphaned rows deleted: {deleted}")
+        return deleted
+
+    except sqlite3.Error as e:
+        conn.rollback()
+        workflow_logger.error(f"Deleting orphaned rows failed, transaction rolled back: {e}")
+        return None
+
+    finally:
+        # Close the database connection (connections of a session are closed with the session)
+        cursor.close()
+        close_connection(conn, session)
+
+def delete_replaced_file_rows(cursor, files):
+    """
+    This function deletes the rows of files which were replaced by a new version at the same path,
+    i.e. whose file_path is given with a different file_id. Without it the new version could not be
+    inserted, since file_path is unique.
+    The rows referencing a file are deleted before the file itself (transformations, labels, bids, files),
+    within the transaction of the cursor, which is not committed.
+
+    Args:
+    cursor (sqlite3.Cursor): A cursor of the database.
+    files (iterable): (file_path, file_id) tuples of the new versions.
+
+    Returns:
+    dict: The number of deleted rows per table.
+    """
+    # Tables in foreign key safe order, with the columns referencing files.file_id
+    tables = [("transformations", ["target_id", "transform_id"]),
+              ("labels", ["file_id"]),
+              ("bids", ["file_id"]),
+              ("files", ["file_id"])]
+    deleted = {}
+
+    # a failed insert on a session connection may have left the temporary tables
+    cursor.execute("DROP TABLE IF EXISTS temp.new_files;")
+    cursor.execute("DROP TABLE IF EXISTS temp.replaced_file_ids;")
+    cursor.execute("CREATE TEMP TABLE new_files (file_path TEXT PRIMARY KEY, file_id TEXT);")
+    cursor.executemany("INSERT OR REPLACE INTO new_files (file_path, file_id) VALUES (?, ?)", files)
+    cursor.execute("""CREATE TEMP TABLE replaced_file_ids AS
+                      SELECT files.file_id FROM files JOIN new_files ON files.file_path = new_files.file_path
+                      WHERE files.file_id <> new_files.file_id;""")
+    for table_name, columns in tables:
+        where_clause = ' OR '.join(f"{column} IN (SELECT file_id FROM replaced_file_ids)" for column in columns)
+        cursor.execute(f"DELETE FROM {table_name} WHERE {where_clause};")
+        deleted[table_name] = max(cursor.rowcount, 0)
+    cursor.execute("DROP TABLE new_files;")
+    cursor.execute("DROP TABLE replaced_file_ids;")
+    return deleted
+
+def begin_change_run(db_file):
+    """
+    This function increments the run counter, which is recorded with every change in the change_log table.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+
+    Returns:
+    int: The run counter of the new run, None if the database has no change tracking.
+    """
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
+    try:
+        if conn.execute("UPDATE sync_state SET value = value + 1 WHERE name = 'run_id';").rowcount == 0:
+            return None
+        run_id = conn.execute("SELECT value FROM sync_state WHERE name = 'run_id';").fetchone()[0]
+        commit_connection(conn, session)
+        return run_id
+    except sqlite3.OperationalError:
+        workflow_logger.debug(f"Database has no change tracking: {db_file}")
+        return None
+    finally:
+        close_connection(conn, session)
+
+def read_change_log(db_file):
+    """
+    This function reads the files changed since the change log was last cleared.
+    Deleted files, which are no longer in the files table, are not returned.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+
+    Returns:
+    list: (file_id, file_path, relative_sidecar_path) tuples of the changed files.
+    int: The last change_id read, to clear the change log up to it (see clear_change_log).
+    None is returned if the database has no change tracking.
+    """
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
+    try:
+        last_change_id = conn.execute("SELECT MAX(change_id) FROM change_log;").fetchone()[0]
+        if last_change_id is None:
+            return [], None
+        changed_files = conn.execute("""SELECT files.file_id, files.file_path, bids.relative_sidecar_path FROM files
+                                        LEFT JOIN bids ON bids.file_id = files.file_id
+                                        WHERE files.file_id IN (SELECT file_id FROM change_log WHERE change_id <= ?);""", (last_change_id,)).fetchall()
+        return changed_files, last_change_id
+    except sqlite3.OperationalError:
+        workflow_logger.debug(f"Database has no change tracking: {db_file}")
+        return None
+    finally:
+        close_connection(conn, session)
+
+def clear_change_log(db_file, last_change_id, keep_file_ids=()):
+    """
+    This function removes the changes up to last_change_id from the change log, once they have been processed.
+    The changes of the files in keep_file_ids (e.g. whose sidecar could not be written) are kept.
+
+    Args:
+    db_file (str): The path to the SQLite database.
+    last_change_id (int): The last processed change_id.
+    keep_file_ids (iterable): The file_ids whose changes are not removed.
+
+    Returns:
+    None
+    """
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
+    try:
+        conn.execute("DROP TABLE IF EXISTS temp.keep_file_ids;")
+        conn.execute("CREATE TEMP TABLE keep_file_ids (file_id TEXT PRIMARY KEY);")
+        conn.executemany("INSERT OR IGNORE INTO keep_file_ids (file_id) VALUES (?)", ((file_id,) for file_id in keep_file_ids))
+        conn.execute("""DELETE FROM change_log WHERE change_id <= ?
+                        AND file_id NOT IN (SELECT file_id FROM keep_file_ids);""", (last_change_id,))
+        conn.execute("DROP TABLE keep_file_ids;")
+        commit_connection(conn, session)
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        close_connection(conn, session)
 
 # Data check Function
 def data_check(db_file):
@@ -218,8 +793,8 @@ def data_check(db_file):
     :param db_file: complete file path to db
     :return: None
     """
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
+    # Connect to the SQLite database, reuse the connection of an active session
+    conn, session = open_connection(db_file)
     
     # Create a cursor object
     cursor = conn.cursor()
@@ -236,8 +811,8 @@ def data_check(db_file):
       count = cursor.fetchone()[0]
       workflow_logger.info(f"Data check: Table {table[0]} has {count} rows.")
     
-    # Close the connection to the database
-    conn.close()
+    # Close the connection to the database (connections of a session are closed with the session)
+    close_connection(conn, session)
 
 def fix_sql_query(sql_query):
     """
@@ -0,0 +1,392 @@
+"""
+File hashing with a persistent hash cache, and file copies with the fastest strategy supported by the file system.
+This module only depends on the standard library: the File2BIDS executables vendor it at build time
+(see .github/workflows), so the ETL and the GUI share one implementation.
+"""
+import os
+import sys
+import time
+import shutil
+import hashlib
+import errno
+import sqlite3
+import threading
+import concurrent.futures
+import mmap
+import logging
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, reflinks are not used there
+    fcntl = None
+
+# Configure logger
+workflow_logger = logging.getLogger('workflow_logger')
+
+HASH_CACHE_FILE_NAME = 'hash_cache.db'
+
+# Path of the hash cache database, None disables the cache (see set_hash_cache)
+hash_cache_path = None
+# Maximum number of cached hashes, the least recently used hashes are evicted
+hash_cache_max_entries = 100000
+# Number of stored hashes after which the cache size is checked
+EVICTION_INTERVAL = 1000
+# Files modified less than this number of seconds before they were hashed are not cached,
+# since a modification within the same mtime tick would not be detected
+MIN_FILE_AGE_S = 2
+# The last use of a cached hash is only updated if it is older than this number of seconds
+LAST_USED_RESOLUTION_S = 3600
+
+_local = threading.local()
+# Connections of all threads keyed by thread identifier, with the process which opened them,
+# they are closed by close_hash_cache_connections
+_connections = {}
+_connections_lock = threading.Lock()
+# Incremented when the connections are closed, so every thread opens a new connection
+_generation = 0
+
+# ioctl request to clone a file (reflink) on Linux file systems like btrfs and XFS
+FICLONE = 0x40049409
+# Strategies of copy_file, in the order they are tried by the "auto" strategy
+COPY_STRATEGIES = ("reflink", "hardlink", "copy_file_range", "copy")
+# Errors raised by a strategy which is not supported for a source/destination pair
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EPERM, errno.EBADF, errno.ENOTSOCK}
+# os.sendfile accepts a regular file as destination only on Linux (on macOS only sockets), as in shutil
+SENDFILE_TO_FILES = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+# Strategies which failed for a (source device, destination device) pair, they are not tried again
+unsupported_strategies = {}
+# Default number of bytes hashed at once, hashlib releases the GIL for chunks of this size
+DEFAULT_HASH_CHUNK_SIZE = 1024 * 1024
+# Read buffers of calculate_hash, one per thread, reused as long as the chunk size does not change
+_hash_buffers = threading.local()
+
+def set_hash_cache(path, max_entries=100000):
+    """
+    This function sets the hash cache database used by calculate_hash.
+
+    Args:
+    path (str): The path of the SQLite database of the cache, None disables the cache.
+    max_entries (int): The maximum number of cached hashes.
+
+    Returns:
+    None
+    """
+    global hash_cache_path, hash_cache_max_entries
+    close_hash_cache_connections()
+    hash_cache_path = path or None
+    hash_cache_max_entries = max_entries
+
+def close_hash_cache_connections(thread_ids=None):
+    """
+    This function closes the hash cache connections of the given threads, e.g. when the threads of a pool
+    have finished, or of all threads. A thread which uses the cache afterwards opens a new connection.
+
+    Args:
+    thread_ids (iterable): The identifiers of the threads (threading.get_ident), None closes all connections.
+
+    Returns:
+    None
+    """
+    global _generation
+    with _connections_lock:
+        for thread_id in list(_connections) if thread_ids is None else thread_ids:
+            pid, conn = _connections.pop(thread_id, (None, None))
+            # connections inherited by a forked process are not closed, they belong to the parent
+            if conn is not None and pid == os.getpid():
+                conn.close()
+        if thread_ids is None:
+            _generation += 1
+
+def get_hash_cache_connection():
+    """
+    This function returns the connection to the hash cache of the calling thread, it is opened (and the cache
+    is created and evicted) on first use. Connections are not shared between threads or forked processes.
+
+    Returns:
+    sqlite3.Connection: The connection, None if the cache is disabled or can not be opened.
+    """
+    if hash_cache_path is None:
+        return None
+    if getattr(_local, 'pid', None) == os.getpid() and getattr(_local, 'generation', None) == _generation:
+        return _local.conn
+    _local.pid = os.getpid()
+    _local.generation = _generation
+    _local.stored = 0
+    conn = None
+    try:
+        # the connection is only used by this thread, but closed by close_hash_cache_connections
+        conn = sqlite3.connect(hash_cache_path, timeout=30, check_same_thread=False)
+        with _connections_lock:
+            _connections[threading.get_ident()] = (os.getpid(), conn)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("""CREATE TABLE IF NOT EXISTS hash_cache
+                        ( dev INTEGER NOT NULL
+                        , inode INTEGER NOT NULL
+                        , size INTEGER NOT NULL
+                        , mtime_ns INTEGER NOT NULL
+                        , algorithm TEXT NOT NULL
+                        , hash TEXT NOT NULL
+                        , last_used INTEGER NOT NULL
+                        , PRIMARY KEY (dev, inode, size, mtime_ns, algorithm)
+                        ) WITHOUT ROWID;""")
+        conn.execute("CREATE INDEX IF NOT EXISTS hash_cache_last_used ON hash_cache (last_used);")
+        conn.commit()
+        evict_hash_cache(conn)
+    except sqlite3.Error as e:
+        workflow_logger.error(f"Hash cache could not be opened, hashes are not cached: {hash_cache_path}: {e}")
+        if conn is not None:
+            close_hash_cache_connections([threading.get_ident()])
+        conn = None
+    _local.conn = conn
+    return conn
+
+def evict_hash_cache(conn):
+    """
+    This function removes the least recently used hashes, if the cache holds more than hash_cache_max_entries hashes.
+
+    Args:
+    conn (sqlite3.Connection): The connection to the hash cache.
+
+    Returns:
+    int: The number of removed hashes.
+    """
+    excess = conn.execute("SELECT COUNT(*) FROM hash_cache;").fetchone()[0] - hash_cache_max_entries
+    if excess <= 0:
+        return 0
+    with conn:
+        conn.execute("""DELETE FROM hash_cache WHERE (dev, inode, size, mtime_ns, algorithm) IN
+                        (SELECT dev, inode, size, mtime_ns, algorithm FROM hash_cache ORDER BY last_used LIMIT ?);""", (excess,))
+    workflow_logger.debug(f"Hash cache: {excess} hashes evicted")
+    return excess
+
+def get_hash_cache_key(file_stat, hash_type):
+    return (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns, hash_type)
+
+def get_cached_hash(filename, hash_type="sha256"):
+    """
+    This function looks up the hash of a file in the hash cache. A file is identified by its
+    device, inode, size and modification time, so a modified file is not found.
+
+    Args:
+    filename (str): The path to the file.
+    hash_type (str): The type of hash algorithm.
+
+    Returns:
+    str: The cached hash, None if the file is not in the cache.
+    os.stat_result: The stat of the file, to store its hash with store_cached_hash.
+    """
+    file_stat = os.stat(filename)
+    conn = get_hash_cache_connection()
+    if conn is None:
+        return None, file_stat
+    key = get_hash_cache_key(file_stat, hash_type)
+    try:
+        row = conn.execute("""SELECT hash, last_used FROM hash_cache
+                              WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ? AND algorithm = ?;""", key).fetchone()
+        if row is None:
+            return None, file_stat
+        now = int(time.time())
+        if now - row[1] > LAST_USED_RESOLUTION_S:
+            with conn:
+                conn.execute("""UPDATE hash_cache SET last_used = ?
+                                WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ? AND algorithm = ?;""", (now,) + key)
+        return row[0], file_stat
+    except sqlite3.Error as e:
+        workflow_logger.error(f"Hash cache lookup failed: {filename}: {e}")
+        return None, file_stat
+
+def store_cached_hash(filename, hash_type, file_stat, file_hash):
+    """
+    This function stores the hash of a file in the hash cache. The hash is only stored, if the file
+    was not modified while it was hashed and it was not modified just before.
+
+    Args:
+    filename (str): The path to the file.
+    hash_type (str): The type of hash algorithm.
+    file_stat (os.stat_result): The stat of the file taken before it was hashed.
+    file_hash (str): The hash of the file.
+
+    Returns:
+    bool: True if the hash was stored.
+    """
+    conn = get_hash_cache_connection()
+    if conn is None:
+        return False
+    key = get_hash_cache_key(file_stat, hash_type)
+    if key != get_hash_cache_key(os.stat(filename), hash_type) or time.time_ns() - file_stat.st_mtime_ns < MIN_FILE_AGE_S * 10**9:
+        return False
+    try:
+        with conn:
+            conn.execute("""INSERT OR REPLACE INTO hash_cache (dev, inode, size, mtime_ns, algorithm, hash, last_used)
+                            VALUES (?, ?, ?, ?, ?, ?, ?);""", key + (file_hash, int(time.time())))
+        _local.stored += 1
+        if _local.stored % EVICTION_INTERVAL == 0:
+            evict_hash_cache(conn)
+        return True
+    except sqlite3.Error as e:
+        workflow_logger.error(f"Hash cache update failed: {filename}: {e}")
+        return False
+
+def calculate_hash(filename, hash_type="sha256", chunk_size=DEFAULT_HASH_CHUNK_SIZE, use_mmap=False):
+    """
+    This function calculates the hash of a file.
+    If a hash cache is set (see set_hash_cache), the hash of an unmodified file is
+    read from the cache instead of the file.
+
+    Args:
+    filename (str): The path to the file.
+    hash_type (str): The type of hash algorithm to use (e.g., "md5", "sha256", "sha1").
+    chunk_size (int): The number of bytes read and hashed at once, MiB-sized chunks are needed to reach disk speed.
+    use_mmap (bool): Hash the memory-mapped file instead of reading it into a buffer.
+
+    Returns:
+    str: The hash of the file as a hexadecimal string.
+    """
+    cached_hash, file_stat = get_cached_hash(filename, hash_type)
+    if cached_hash is not None:
+        return cached_hash
+
+    hasher = hashlib.new(hash_type)
+    # Open the file in binary mode
+    with open(filename, "rb") as f:
+        if use_mmap and file_stat.st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(0, len(view), chunk_size):
+                    hasher.update(view[offset:offset + chunk_size])
+        else:
+            # Reuse the buffer of the thread, so no new bytes object is allocated per chunk
+            buffer = getattr(_hash_buffers, "buffer", None)
+            if buffer is None or len(buffer) != chunk_size:
+                buffer = _hash_buffers.buffer = bytearray(chunk_size)
+            view = memoryview(buffer)
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                hasher.update(view[:size])
+
+    file_hash = hasher.hexdigest()
+    store_cached_hash(filename, hash_type, file_stat, file_hash)
+    # Return the hash as a hexadecimal string
+    return file_hash
+
+def iter_hashes(filenames, hash_type="sha256", num_workers=1, chunk_size=DEFAULT_HASH_CHUNK_SIZE, use_mmap=False):
+    """
+    This function calculates the hashes of many files, with more than one worker the files are hashed concurrently
+    in a thread pool (hashlib and file reads release the GIL, so the threads run in parallel).
+    The hash cache connections of the pool threads are closed when the pool shuts down.
+
+    Args:
+    filenames (iterable): The paths to the files.
+    hash_type (str): The type of hash algorithm to use (e.g., "md5", "sha256", "sha1").
+    num_workers (int): The number of files hashed concurrently, 1 hashes serially.
+    chunk_size (int): The number of bytes read and hashed at once.
+    use_mmap (bool): Hash the memory-mapped files instead of reading them into a buffer.
+
+    Returns:
+    iterator: The hashes of the files as hexadecimal strings, in the order of the files.
+    """
+    if num_workers <= 1:
+        yield from (calculate_hash(filename, hash_type, chunk_size, use_mmap) for filename in filenames)
+        return
+    # threads of the pool, whose connections are closed when the pool has shut down
+    thread_ids = set()
+    def hash_file(filename):
+        thread_ids.add(threading.get_ident())
+        return calculate_hash(filename, hash_type, chunk_size, use_mmap)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            yield from executor.map(hash_file, filenames)
+    finally:
+        close_hash_cache_connections(thread_ids)
+
+def hash_files(filenames, hash_type="sha256", num_workers=1, chunk_size=DEFAULT_HASH_CHUNK_SIZE, use_mmap=False):
+    """
+    This function calculates the hashes of many files with iter_hashes.
+
+    Args:
+    filenames (iterable): The paths to the files.
+    hash_type (str): The type of hash algorithm to use (e.g., "md5", "sha256", "sha1").
+    num_workers (int): The number of files hashed concurrently, 1 hashes serially.
+    chunk_size (int): The number of bytes read and hashed at once.
+    use_mmap (bool): Hash the memory-mapped files instead of reading them into a buffer.
+
+    Returns:
+    dict: The hash of each file as a hexadecimal string, keyed by its path.
+    """
+    filenames = list(filenames)
+    return dict(zip(filenames, iter_hashes(filenames, hash_type, num_workers, chunk_size, use_mmap)))
+
+def copy_file(src, dst, strategy="auto", immutable=False):
+    """
+    This function copies a file with the given strategy, the file metadata (e.g. modification time) is copied
+    as with shutil.copy2.
+    - reflink: the destination shares the data blocks of the source until one of them is modified (btrfs, XFS)
+    - hardlink: the destination is the same file as the source, only used if the source is immutable
+    - copy_file_range: the data is copied by the kernel (os.copy_file_range or os.sendfile), without passing through python
+    - copy: plain copy (shutil.copyfile)
+    With "auto" the strategies are tried in this order, a strategy failing for a source/destination
+    pair of devices is not tried again for this pair.
+
+    Args:
+    src (str): The path of the source file.
+    dst (str): The path of the destination file.
+    strategy (str): "auto" or one of COPY_STRATEGIES.
+    immutable (bool): True if the source is never modified, which allows the "auto" strategy to use hardlinks.
+
+    Returns:
+    str: The strategy used.
+    """
+    if strategy != "auto":
+        _copy_functions[strategy](src, dst)
+        return strategy
+
+    pair = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+    unsupported = unsupported_strategies.setdefault(pair, set())
+    for candidate in COPY_STRATEGIES:
+        if candidate in unsupported or (candidate == "hardlink" and not immutable):
+            continue
+        try:
+            _copy_functions[candidate](src, dst)
+            return candidate
+        except OSError as e:
+            if candidate == "copy" or e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            workflow_logger.debug(f"Copy strategy {candidate} is not supported for {src} -> {dst}: {e}")
+            unsupported.add(candidate)
+
+def _copy_reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+def _copy_hardlink(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    os.link(src, dst)
+
+def _copy_file_range(src, dst):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        while remaining > 0:
+            if hasattr(os, "copy_file_range"):
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            elif SENDFILE_TO_FILES:
+                copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, remaining)
+            else:
+                raise OSError(errno.ENOSYS, "copy_file_range and sendfile are not supported on this platform")
+            if copied == 0:
+                break
+            offset += copied
+            remaining -= copied
+    shutil.copystat(src, dst)
+
+def _copy_plain(src, dst):
+    shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+_copy_functions = {"reflink": _copy_reflink, "hardlink": _copy_hardlink, "copy_file_range": _copy_file_range, "copy": _copy_plain}
@@ -0,0 +1,75 @@
+"""
+Throughput benchmark of the file hashing: the former calculate_hash (4 KiB reads, a new bytes object per chunk)
+against calculate_hash/hash_files with different chunk sizes, mmap and thread pool sizes.
+The hash cache is disabled, so every file is read.
+
+Usage: python PyUtilities/hash_benchmark.py <directory or file> [<directory or file> ...]
+
+The first pass reads the files into the page cache, all results are measured with a warm page cache
+(drop the page cache between the runs to measure the disk instead).
+"""
+
+import sys
+import os
+import time
+import hashlib
+
+# Add the parent directory to the sys.path
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from PyUtilities.fileFunctions import set_hash_cache
+from PyUtilities.fileFunctions import hash_files
+
+MIB = 1024 * 1024
+CHUNK_SIZES_MIB = [0.25, 1, 4, 16]
+NUM_WORKERS = [1, 2, 4, 8]
+
+def legacy_calculate_hash(filename, hash_type="sha256"):
+    # calculate_hash before the hashing engine, kept as the baseline
+    with open(filename, "rb") as f:
+        hasher = hashlib.new(hash_type)
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                break
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in sorted(names))
+    return files
+
+def run_benchmark(name, function, total_bytes, reference):
+    start = time.perf_counter()
+    hashes = function()
+    duration = time.perf_counter() - start
+    assert hashes == reference, f"{name}: hashes differ from the baseline"
+    print(f"{name:<40} {duration:8.2f} s {total_bytes / MIB / duration:10.1f} MiB/s")
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    set_hash_cache(None)
+    files = collect_files(sys.argv[1:])
+    total_bytes = sum(os.path.getsize(file) for file in files)
+    print(f"{len(files)} files, {total_bytes / MIB:.1f} MiB")
+
+    # warm up the page cache and compute the reference hashes
+    reference = {file: legacy_calculate_hash(file) for file in files}
+    run_benchmark("legacy (4 KiB read)", lambda: {file: legacy_calculate_hash(file) for file in files}, total_bytes, reference)
+    for chunk_size_mib in CHUNK_SIZES_MIB:
+        chunk_size = int(chunk_size_mib * MIB)
+        run_benchmark(f"readinto {chunk_size_mib} MiB", lambda: hash_files(files, chunk_size=chunk_size), total_bytes, reference)
+    run_benchmark("mmap 1 MiB", lambda: hash_files(files, use_mmap=True), total_bytes, reference)
+    for num_workers in NUM_WORKERS[1:]:
+        run_benchmark(f"readinto 1 MiB, {num_workers} threads", lambda: hash_files(files, num_workers=num_workers), total_bytes, reference)
+
+if __name__ == '__main__':
+    main()
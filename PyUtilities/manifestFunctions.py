@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import logging
+
+from PyUtilities.utility_functions import get_relative_path
+
+# Configure logger
+workflow_logger = logging.getLogger('workflow_logger')
+
+MANIFEST_FILE_NAME = 'sidecar_manifest.json'
+PENDING_MANIFEST_FILE_NAME = 'sidecar_manifest.pending.json'
+
+def hash_content(content, hash_type="sha256"):
+    """
+    This function calculates the hash of an in-memory file content.
+
+    Args:
+    content (bytes): The file content.
+    hash_type (str): The type of hash algorithm to use (e.g., "md5", "sha256", "sha1").
+
+    Returns:
+    str: The hash of the content as a hexadecimal string.
+    """
+    hasher = hashlib.new(hash_type)
+    hasher.update(content)
+    return hasher.hexdigest()
+
+def stat_manifest_entry(file_path):
+    """
+    This function collects the file attributes used to detect a changed file without reading it.
+
+    Args:
+    file_path (str): The path to the file.
+
+    Returns:
+    dict: size, mtime_ns and inode of the file.
+    """
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+def read_manifest(manifest_path):
+    """
+    This function reads the manifest of the last successful run.
+
+    Args:
+    manifest_path (str): The path to the manifest file.
+
+    Returns:
+    dict: The manifest entries keyed by the sidecar path relative to the BIDS root.
+    An empty dict is returned if no (valid) manifest exists, which triggers a full extraction.
+    """
+    if not os.path.exists(manifest_path):
+        workflow_logger.info(f"No manifest found, full extraction is performed: {manifest_path}")
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        workflow_logger.error(f"Manifest could not be read, full extraction is performed: {manifest_path}: {e}")
+        return {}
+    return manifest.get("sidecars", {})
+
+def write_manifest(manifest_path, manifest):
+    """
+    This function writes the manifest atomically (temporary file + rename).
+
+    Args:
+    manifest_path (str): The path to the manifest file.
+    manifest (dict): The manifest entries keyed by the relative sidecar path.
+
+    Returns:
+    None
+    """
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({"sidecars": manifest}, f)
+    os.replace(tmp_path, manifest_path)
+
+def commit_manifest(extraction_path):
+    """
+    This function promotes the manifest of the current run to the manifest of the last successful run.
+    It has to be called only after the extracted data has been loaded successfully.
+
+    Args:
+    extraction_path (str): The directory in which the manifests are stored.
+
+    Returns:
+    None
+    """
+    pending_path = os.path.join(extraction_path, PENDING_MANIFEST_FILE_NAME)
+    if not os.path.exists(pending_path):
+        workflow_logger.debug(f"No pending manifest to commit: {pending_path}")
+        return None
+    os.replace(pending_path, os.path.join(extraction_path, MANIFEST_FILE_NAME))
+    workflow_logger.debug(f"Manifest committed: {extraction_path}")
+
+def diff_manifest(files, root_path, previous_manifest):
+    """
+    This function compares the current files with the manifest of the last successful run.
+    Only the file attributes are compared, the files themselves are not read.
+
+    Args:
+    files (list): Paths of the current files.
+    root_path (str): The root directory the manifest keys are relative to.
+    previous_manifest (dict): The manifest of the last successful run.
+
+    Returns:
+    candidates (list): Paths of the added files and of the files whose attributes changed.
+    deleted (dict): The manifest entries of the files which no longer exist.
+    manifest (dict): The manifest of the current run. Entries of candidates have no hash yet.
+    """
+    candidates = []
+    manifest = {}
+    for file_path in files:
+        rel_path = get_relative_path(file_path, root_path)
+        entry = stat_manifest_entry(file_path)
+        previous_entry = previous_manifest.get(rel_path)
+        if previous_entry is not None and all(previous_entry.get(key) == value for key, value in entry.items()):
+            # unchanged file: keep the hash and file_id of the last run
+            manifest[rel_path] = previous_entry
+        else:
+            manifest[rel_path] = entry
+            candidates.append(file_path)
+
+    deleted = {rel_path: entry for rel_path, entry in previous_manifest.items() if rel_path not in manifest}
+    workflow_logger.info(f"Manifest diff: {len(candidates)} new or modified, {len(deleted)} deleted, {len(manifest) - len(candidates)} unchanged sidecars")
+    return candidates, deleted, manifest
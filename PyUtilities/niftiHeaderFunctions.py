@@ -0,0 +1,109 @@
+import struct
+import zlib
+import logging
+
+# Configure logger
+workflow_logger = logging.getLogger('workflow_logger')
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+# Number of compressed bytes read at once from a .nii.gz file, until the header is decompressed
+GZIP_READ_SIZE = 4096
+
+# Columns of the bids table filled from the NIfTI header
+NIFTI_HEADER_COLUMNS = ["image_dimensions", "voxel_sizes", "image_datatype", "qform_code", "qform",
+                        "sform_code", "sform", "image_description"]
+
+# NIfTI datatype codes
+NIFTI_DATATYPES = {2: "uint8", 4: "int16", 8: "int32", 16: "float32", 32: "complex64", 64: "float64",
+                   128: "rgb24", 256: "int8", 512: "uint16", 768: "uint32", 1024: "int64", 1280: "uint64",
+                   1536: "float128", 1792: "complex128", 2048: "complex256", 2304: "rgba32"}
+
+# struct layouts of the header fields used, (offset, format) for NIfTI-1 and NIfTI-2
+NIFTI1_FIELDS = {"datatype": (70, "h"), "dim": (40, "8h"), "pixdim": (76, "8f"), "descrip": (148, "80s"),
+                 "qform_code": (252, "h"), "sform_code": (254, "h"), "quatern": (256, "6f"), "srow": (280, "12f")}
+NIFTI2_FIELDS = {"datatype": (12, "h"), "dim": (16, "8q"), "pixdim": (104, "8d"), "descrip": (240, "80s"),
+                 "qform_code": (344, "i"), "sform_code": (348, "i"), "quatern": (352, "6d"), "srow": (400, "12d")}
+
+def read_header_bytes(file_path, size=NIFTI2_HEADER_SIZE):
+    """
+    This function reads the first bytes of a .nii or .nii.gz file. Of a compressed file only
+    as much is decompressed as needed for the header, the volume is never inflated.
+
+    Args:
+    file_path (str): The path to the NIfTI file.
+    size (int): The number of bytes to read.
+
+    Returns:
+    bytes: The first size bytes of the (decompressed) file, fewer if the file is shorter.
+    """
+    with open(file_path, 'rb') as f:
+        if not str(file_path).endswith('.gz'):
+            return f.read(size)
+        # 16 + MAX_WBITS: gzip header and trailer
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        header = b''
+        while len(header) < size:
+            chunk = decompressor.unconsumed_tail or f.read(GZIP_READ_SIZE)
+            if not chunk:
+                break
+            header += decompressor.decompress(chunk, size - len(header))
+        return header
+
+def format_values(values):
+    return " ".join(f"{value:.6g}" for value in values)
+
+def read_nifti_header(file_path):
+    """
+    This function reads the geometry of a NIfTI-1 or NIfTI-2 image from its header.
+
+    Args:
+    file_path (str): The path to the .nii or .nii.gz file.
+
+    Returns:
+    dict: The values of the NIFTI_HEADER_COLUMNS, None if the file is not a NIfTI image.
+    """
+    header = read_header_bytes(file_path)
+    for endian in "<>":
+        if len(header) < NIFTI1_HEADER_SIZE:
+            break
+        sizeof_hdr = struct.unpack_from(endian + "i", header)[0]
+        if sizeof_hdr == NIFTI1_HEADER_SIZE and header[344:347] in (b"n+1", b"ni1"):
+            fields = NIFTI1_FIELDS
+        elif sizeof_hdr == NIFTI2_HEADER_SIZE and len(header) >= NIFTI2_HEADER_SIZE and header[4:7] in (b"n+2", b"ni2"):
+            fields = NIFTI2_FIELDS
+        else:
+            continue
+        values = {name: struct.unpack_from(endian + fmt, header, offset) for name, (offset, fmt) in fields.items()}
+        dim = values["dim"]
+        # dim[0] is the number of dimensions, pixdim[0] the qfac of the qform
+        ndim = dim[0] if 1 <= dim[0] <= 7 else 3
+        pixdim = values["pixdim"]
+        datatype = values["datatype"][0]
+        return {"image_dimensions": "x".join(str(size) for size in dim[1:ndim + 1]),
+                "voxel_sizes": "x".join(f"{size:.6g}" for size in pixdim[1:ndim + 1]),
+                "image_datatype": NIFTI_DATATYPES.get(datatype, str(datatype)),
+                "qform_code": values["qform_code"][0],
+                "qform": format_values(values["quatern"] + (-1.0 if pixdim[0] < 0 else 1.0,)),
+                "sform_code": values["sform_code"][0],
+                "sform": format_values(values["srow"]),
+                "image_description": values["descrip"][0].split(b"\0", 1)[0].decode("ascii", errors="replace").strip()}
+    workflow_logger.debug(f"Not a NIfTI file: {file_path}")
+    return None
+
+def try_read_nifti_header(file_path):
+    """
+    This function reads the geometry of a NIfTI image like read_nifti_header, but logs the error instead
+    of raising it, so that one unreadable image does not stop a conversion or extraction.
+
+    Args:
+    file_path (str): The path to the .nii or .nii.gz file.
+
+    Returns:
+    dict: The values of the NIFTI_HEADER_COLUMNS, None if the header could not be read.
+    """
+    try:
+        return read_nifti_header(file_path)
+    except (OSError, zlib.error, struct.error) as e:
+        workflow_logger.error(f"NIfTI header could not be read: {file_path}: {e}")
+        return None
@@ -26,6 +26,190 @@ def write_json_from_dict(fname, data_dict):
         json.dump(data_dict, file, indent=4)
 
 
+def write_json_atomic(fname, data_dict, indent=4, fsync=False):
+    """
+    Writes a dict as JSON file to a temporary file and renames it, readers never see a partial file.
+    The JSON is serialized first and written with a single write call.
+    :param fname: path of the JSON file
+    :param data_dict: JSON serializable dict
+    :param indent: indentation of the JSON file
+    :param fsync: if True, the file and its directory are synced to disk, so the file survives a crash of the OS
+    :return: None
+    """
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'w') as file:
+        file.write(json.dumps(data_dict, indent=indent))
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(tmp_fname, fname)
+    if fsync:
+        fsync_directory(os.path.dirname(os.path.abspath(fname)))
+
+
+def fsync_directory(path):
+    """
+    Syncs a directory to disk, which makes the renames of files within it durable.
+    Directories can not be synced on Windows, nothing is done there.
+    :param path: path of the directory
+    :return: None
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SidecarWriter:
+    """
+    Writes JSON sidecar files atomically: each file is serialized in one call, written to a temporary file
+    and renamed. A sidecar whose content would not change is not written, so it keeps its modification time.
+
+    With fsync the temporary files are synced and renamed in batches of batch_size files, and every
+    directory is synced once per batch instead of once per file. A sidecar of a batch appears only when
+    the batch is flushed (at the latest when the writer is closed).
+
+    Example:
+    with SidecarWriter(fsync=True) as sidecar_writer:
+        for sidecar_path, data in sidecars:
+            sidecar_writer.write(sidecar_path, data)
+    """
+
+    def __init__(self, fsync=False, batch_size=1000, indent=4):
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.indent = indent
+        self.pending = []
+
+    def write(self, fname, data_dict):
+        """
+        Writes a sidecar file, unless it already has the same content.
+        :param fname: path of the sidecar file
+        :param data_dict: JSON serializable dict
+        :return: True if the file was written
+        """
+        content = json.dumps(data_dict, indent=self.indent)
+        try:
+            with open(fname, 'r') as file:
+                if file.read() == content:
+                    return False
+        except FileNotFoundError:
+            pass
+        tmp_fname = fname + '.tmp'
+        with open(tmp_fname, 'w') as file:
+            file.write(content)
+        if not self.fsync:
+            os.replace(tmp_fname, fname)
+            return True
+        self.pending.append((tmp_fname, fname))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        Syncs and renames the pending sidecar files, then syncs their directories.
+        :return: number of sidecar files flushed
+        """
+        for tmp_fname, _ in self.pending:
+            fd = os.open(tmp_fname, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for tmp_fname, fname in self.pending:
+            os.replace(tmp_fname, fname)
+        for directory in {os.path.dirname(os.path.abspath(fname)) for _, fname in self.pending}:
+            fsync_directory(directory)
+        flushed = len(self.pending)
+        self.pending = []
+        return flushed
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the pending files are complete, so they are flushed on errors as well
+        self.close()
+        return False
+
+
+def write_ndjson(fname, records, index=None, index_key=None):
+    """
+    Writes records as newline delimited JSON, one record per line.
+    The records are consumed lazily, so a generator is never held in memory as a whole.
+    The file is written to a temporary file and renamed, readers never see a partial file.
+    :param fname: path of the NDJSON file
+    :param records: iterable of JSON serializable records
+    :param index: optional dict, filled with the byte offset of every record keyed by record[index_key]
+    :param index_key: key of the records used for the index
+    :return: number of written records
+    """
+    count = 0
+    offset = 0
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'w', encoding='ascii') as file:
+        for record in records:
+            # json.dumps escapes non ascii characters, so the string length is the byte length
+            line = json.dumps(record) + '\n'
+            if index is not None:
+                index[record[index_key]] = offset
+            file.write(line)
+            offset += len(line)
+            count += 1
+    os.replace(tmp_fname, fname)
+    return count
+
+
+def index_ndjson(fname, index_key):
+    """
+    Builds an index of a NDJSON file without keeping the records in memory.
+    :param fname: path of the NDJSON file
+    :param index_key: key of the records used for the index
+    :return: dict with the byte offset of every record keyed by record[index_key]
+    """
+    index = {}
+    with open(fname, 'rb') as file:
+        offset = 0
+        for line in file:
+            if line.strip():
+                index[json.loads(line)[index_key]] = offset
+            offset += len(line)
+    return index
+
+
+def read_ndjson_record(file, offset):
+    """
+    Reads the single NDJSON record starting at a byte offset (see index_ndjson).
+    :param file: NDJSON file opened in binary mode
+    :param offset: byte offset of the record
+    :return: the record
+    """
+    file.seek(offset)
+    return json.loads(file.readline())
+
+
+def read_ndjson(fname):
+    """
+    Reads a newline delimited JSON file lazily, one record at a time.
+    :param fname: path of the NDJSON file
+    :return: generator of the records
+    """
+    with open(fname, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
 def listdir_no_hidden(path):
     for f in os.listdir(path):
         if not f.startswith('.'):
@@ -3,39 +3,314 @@ import shutil
 from os.path import join, splitext
 from pathlib import Path
 import hashlib
+import concurrent.futures
+import zlib
+import struct
+from collections import deque
+from PyUtilities.fileFunctions import store_cached_hash, calculate_hash, copy_file, unsupported_strategies, UNSUPPORTED_ERRNOS, DEFAULT_HASH_CHUNK_SIZE
 
-def calculate_hash(filename, hash_type="sha256"):
-  """
-  Calculates the hash of a file.
-
-  Args:
-    filename: The path to the file.
-    hash_type: The type of hash algorithm to use (e.g., "md5", "sha256", "sha1").
-
-  Returns:
-    The hash of the file as a hexadecimal string.
-  """
-  
-  # Open the file in binary mode
-  with open(filename, "rb") as f:
-    # Create a hash object
+# Number of uncompressed bytes compressed as one independent deflate block by compress_and_hash
+DEFAULT_GZIP_BLOCK_SIZE = 1024 * 1024
+# Number of bytes of the previous block used as dictionary of the next one (the deflate window)
+GZIP_DICT_SIZE = 32 * 1024
+
+def copy_and_hash(src, dst, hash_type="sha256", chunk_size=DEFAULT_HASH_CHUNK_SIZE, strategy="copy", immutable=False):
+    """
+    Copies a file and calculates its hash in the same pass, so the source is read only once.
+    The file metadata (e.g. modification time) is copied as with shutil.copy2.
+    If the strategy allows it, the file is reflinked or hardlinked (see copy_file) and only read to calculate the hash,
+    otherwise it is copied by the hashing loop.
+
+    :param src: path of the source file
+    :param dst: path of the destination file
+    :param hash_type: type of hash algorithm to use (e.g., "md5", "sha256", "sha1")
+    :param chunk_size: number of bytes read and written at once
+    :param strategy: "auto", "reflink" or "hardlink" link the file if possible, other strategies copy it in the hashing loop
+    :param immutable: True if the source is never modified, which allows the "auto" strategy to use hardlinks
+    :return: hash of the file as a hexadecimal string
+    The hash is stored in the hash cache (if set) for both the source and the destination.
+    """
+    if strategy in ("auto", "reflink", "hardlink"):
+        pair = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+        candidates = ["reflink", "hardlink"] if strategy == "auto" else [strategy]
+        for candidate in candidates:
+            if candidate in unsupported_strategies.get(pair, set()) or (strategy == "auto" and candidate == "hardlink" and not immutable):
+                continue
+            try:
+                copy_file(src, dst, candidate)
+                file_hash = calculate_hash(src, hash_type, chunk_size)
+                store_cached_hash(dst, hash_type, os.stat(dst), file_hash)
+                return file_hash
+            except OSError as e:
+                if strategy != "auto" or e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                unsupported_strategies.setdefault(pair, set()).add(candidate)
+
+    src_stat = os.stat(src)
     hasher = hashlib.new(hash_type)
-    
-    # Read the file in chunks and update the hash
-    chunk_size = 4096  # You can adjust this value based on your needs
-    while True:
-      chunk = f.read(chunk_size)
-      if not chunk:
-        break
-      hasher.update(chunk)
-    
-    # Return the hash as a hexadecimal string
-    return hasher.hexdigest()
-    
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        while True:
+            size = fsrc.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
+            fdst.write(view[:size])
+    shutil.copystat(src, dst)
+    file_hash = hasher.hexdigest()
+    store_cached_hash(src, hash_type, src_stat, file_hash)
+    store_cached_hash(dst, hash_type, os.stat(dst), file_hash)
+    return file_hash
+
+
+def copy_and_hash_if_changed(src, dst, hash_type="sha256", chunk_size=DEFAULT_HASH_CHUNK_SIZE, strategy="copy", immutable=False):
+    """
+    Copies a file with copy_and_hash, unless the destination already holds an identical file.
+    The destination is identical if it has the same size and modification time as the source (copy_and_hash copies
+    the modification time) and the same hash. The hashes are looked up in the hash cache, so with the cache set
+    an unchanged file is neither read nor copied.
+
+    :param src: path of the source file
+    :param dst: path of the destination file
+    :param hash_type: type of hash algorithm to use (e.g., "md5", "sha256", "sha1")
+    :param chunk_size: number of bytes read and written at once
+    :param strategy: copy strategy, see copy_and_hash
+    :param immutable: True if the source is never modified, see copy_and_hash
+    :return: hash of the file as a hexadecimal string
+    :return: True if the file was copied, False if the destination was already up to date
+    """
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        dst_stat = None
+    src_stat = os.stat(src)
+    if dst_stat is not None and dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns:
+        src_hash = calculate_hash(src, hash_type, chunk_size)
+        # a hardlinked destination is the source itself
+        same_file = (dst_stat.st_dev, dst_stat.st_ino) == (src_stat.st_dev, src_stat.st_ino)
+        if same_file or calculate_hash(dst, hash_type, chunk_size) == src_hash:
+            return src_hash, False
+    if dst_stat is not None:
+        # never write through a hardlink into the source
+        os.remove(dst)
+    return copy_and_hash(src, dst, hash_type, chunk_size, strategy, immutable), True
+
+
+def _compress_block(block, zdict, level, last):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict) if zdict else zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # a sync flush ends the block on a byte boundary, so the blocks can be concatenated to one deflate stream
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def compress_and_hash(src, dst, hash_type="sha256", level=6, num_workers=4, block_size=DEFAULT_GZIP_BLOCK_SIZE, source_hash=None):
+    """
+    Compresses a file to gzip and calculates the hash of the compressed file in the same pass (like pigz).
+    The file is split into blocks which are compressed independently by num_workers threads (zlib releases the GIL),
+    each block using the end of the previous one as dictionary. The output is a standard single-member gzip file.
+    The gzip header has no timestamp, so the same content always gives the same compressed file and hash.
+    The file is written to a temporary file which replaces dst when it is complete, so dst is never truncated.
+    The modification time of the source is copied to the destination.
+
+    :param src: path of the uncompressed source file
+    :param dst: path of the compressed destination file
+    :param hash_type: type of hash algorithm to use (e.g., "md5", "sha256", "sha1")
+    :param level: compression level (1-9)
+    :param num_workers: number of blocks compressed concurrently
+    :param block_size: number of uncompressed bytes per block
+    :param source_hash: hash of the source, stored in the comment of the gzip header (see compress_and_hash_if_changed)
+    :return: hash of the compressed file as a hexadecimal string
+    """
+    hasher = hashlib.new(hash_type)
+    crc = 0
+    size = 0
+
+    def write(data):
+        hasher.update(data)
+        fdst.write(data)
+
+    tmp_dst = dst + ".tmp"
+    try:
+        with open(src, "rb") as fsrc, open(tmp_dst, "wb") as fdst, concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # gzip header: magic, deflate, flags, no timestamp, no extra flags, unknown OS
+            if source_hash is None:
+                write(b"\x1f\x8b\x08\x00" + struct.pack("<I", 0) + b"\x00\xff")
+            else:
+                # FCOMMENT flag, the zero-terminated comment follows the header
+                write(b"\x1f\x8b\x08\x10" + struct.pack("<I", 0) + b"\x00\xff" + f"{hash_type}:{source_hash}".encode("latin-1") + b"\x00")
+            pending = deque()
+            zdict = None
+            block = fsrc.read(block_size)
+            while True:
+                next_block = fsrc.read(block_size)
+                last = not next_block
+                pending.append(executor.submit(_compress_block, block, zdict, level, last))
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                zdict = block[-GZIP_DICT_SIZE:]
+                # write the finished blocks in order, at most 2 blocks per worker are held in memory
+                while pending and (last or len(pending) >= 2 * num_workers):
+                    write(pending.popleft().result())
+                if last:
+                    break
+                block = next_block
+            # gzip trailer: crc32 and size of the uncompressed data
+            write(struct.pack("<II", crc, size & 0xFFFFFFFF))
+        src_stat = os.stat(src)
+        os.utime(tmp_dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        # replacing (instead of writing through) dst also never writes into a file hardlinked to dst
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        if os.path.exists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+    file_hash = hasher.hexdigest()
+    store_cached_hash(dst, hash_type, os.stat(dst), file_hash)
+    return file_hash
+
+
+def read_gzip_comment(path):
+    """
+    Reads the comment of the header of a gzip file.
+
+    :param path: path of the gzip file
+    :return: the comment, None if the file has no comment or is no gzip file
+    """
+    with open(path, "rb") as f:
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b"\x1f\x8b\x08":
+            return None
+        flags = header[3]
+        if not flags & 0x10:
+            return None
+        if flags & 0x04:
+            # FEXTRA: length and extra field
+            f.seek(struct.unpack("<H", f.read(2))[0], os.SEEK_CUR)
+        fields = []
+        for flag in (0x08, 0x10):
+            if flags & flag:
+                # FNAME and FCOMMENT: zero-terminated strings
+                field = bytearray()
+                while (byte := f.read(1)) not in (b"", b"\x00"):
+                    field += byte
+                fields.append(bytes(field))
+        return fields[-1].decode("latin-1")
+
+
+def compress_and_hash_if_changed(src, dst, hash_type="sha256", level=6, num_workers=4, block_size=DEFAULT_GZIP_BLOCK_SIZE):
+    """
+    Compresses a file with compress_and_hash, unless the destination is already its compressed version,
+    i.e. the comment of its gzip header holds the hash of the source. The hashes of the unchanged source
+    and destination are looked up in the hash cache, so with the cache set an unchanged file is not read.
+
+    :param src: path of the uncompressed source file
+    :param dst: path of the compressed destination file
+    :param hash_type: type of hash algorithm to use (e.g., "md5", "sha256", "sha1")
+    :param level: compression level (1-9)
+    :param num_workers: number of blocks compressed concurrently
+    :param block_size: number of uncompressed bytes per block
+    :return: hash of the compressed file as a hexadecimal string
+    :return: True if the file was compressed, False if the destination was already up to date
+    """
+    source_hash = calculate_hash(src, hash_type)
+    try:
+        comment = read_gzip_comment(dst)
+    except OSError:
+        comment = None
+    if comment == f"{hash_type}:{source_hash}":
+        return calculate_hash(dst, hash_type), False
+    return compress_and_hash(src, dst, hash_type, level, num_workers, block_size, source_hash), True
+
+
+def scan_files(root_path, suffix, num_workers=1):
+    """
+    Recursively finds all files ending with suffix below root_path.
+    With more than one worker every subdirectory is scanned with os.scandir in a thread pool,
+    which hides the per-directory latency of network file systems.
+    Symbolic links to directories are not followed.
+
+    :param root_path: directory to scan
+    :param suffix: file name suffix to match (e.g. '_sidecar.json')
+    :param num_workers: number of directories scanned concurrently, 1 scans serially
+    :return: sorted list of Path objects, independent of num_workers
+    """
+    found = []
+    if num_workers <= 1:
+        pending = [root_path]
+        while pending:
+            files, subdirs = _scan_directory(pending.pop(), suffix)
+            found.extend(files)
+            pending.extend(subdirs)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+            futures = {executor.submit(_scan_directory, root_path, suffix)}
+            while futures:
+                done, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    found.extend(files)
+                    futures.update(executor.submit(_scan_directory, subdir, suffix) for subdir in subdirs)
+
+    return sorted(Path(file_path) for file_path in found)
+
+
+def _scan_directory(dir_path, suffix):
+    """
+    Lists one directory level.
+
+    :param dir_path: directory to list
+    :param suffix: file name suffix to match
+    :return: tuple of the matching file paths and the subdirectory paths
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    files.append(entry.path)
+    except OSError as e:
+        print(f"Error scanning {dir_path}: {e}")
+    return files, subdirs
+
+
+def get_relative_path(file_path, root_path):
+    """
+    Returns the path of a file relative to a root directory, always with '/' as separator,
+    so that it can be used as a platform independent key.
+
+    :param file_path: path of the file
+    :param root_path: root directory
+    :return: relative path as string
+    """
+    return Path(os.path.relpath(file_path, root_path)).as_posix()
+
+
+def get_sidecar_path(file_path, relative_sidecar_path=None):
+    """
+    Returns the sidecar path of a BIDS file, following the naming of the File2BIDS sidecar creator:
+    'sub-01/anat/sub-01_T1w.nii.gz' -> 'sub-01/anat/sub-01_T1w_sidecar.json'
+    Only the extension of the file name is replaced (from its first dot, e.g. '.nii.gz' or '.mnc.gz'),
+    so dotted directories such as 'ses-1.5' are kept.
+
+    :param file_path: (relative) path of the BIDS file
+    :param relative_sidecar_path: sidecar path stored in the bids table, returned if it is a .json path
+    :return: (relative) path of its sidecar file
+    """
+    if isinstance(relative_sidecar_path, str) and relative_sidecar_path.endswith('.json'):
+        return relative_sidecar_path
+    path = Path(file_path)
+    return path.with_name(f"{path.name.split('.', 1)[0]}_sidecar.json").as_posix()
+
 
 def mkdir_if_not_exists(path):
-    if not os.path.exists(path):
+    # no check before mkdir, so that concurrent workers creating the same directory do not fail
+    try:
         os.mkdir(path)
+    except FileExistsError:
+        pass
 
 
 def copy_dir_structure(in_path, out_path, root_dirs_to_ignore, keep_json=False, ignore_files=True):
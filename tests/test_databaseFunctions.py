@@ -0,0 +1,152 @@
+import os
+import sqlite3
+
+from PyUtilities.databaseFunctions import create_database, insert_rows_batched, read_change_log, clear_change_log, execute_sql_script, DatabaseSession
+
+SCHEMA = os.path.join(os.path.dirname(__file__), os.pardir, "IMS_setup", "SQLite_setup", "sqlite_schema.sql")
+
+
+def file_rows(file_id, file_path):
+    return [("files", {"file_id": file_id, "subject_id": "1", "file_path": file_path, "file_type": "raw-image"}),
+            ("bids", {"file_id": file_id, "modality": "MR", "bids_subject": "01", "bids_session": "Pre",
+                      "bids_extension": "nii.gz", "bids_datatype": "anat", "bids_acquisition": "T1", "bids_suffix": "T1w"})]
+
+
+def test_upsert_replaces_rehashed_file_at_same_path(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    file_path = "sub-01/ses-Pre/anat/sub-01_ses-Pre_acq-T1_T1w.nii.gz"
+    assert insert_rows_batched(file_rows("old", file_path) + file_rows("other", "sub-01/other.nii.gz"), db_file, upsert=True) is not None
+
+    # the image was re-hashed: same file_path, new file_id
+    assert insert_rows_batched(file_rows("new", file_path), db_file, upsert=True) is not None
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT file_id FROM files WHERE file_path = ?", (file_path,)).fetchall() == [("new",)]
+    assert sorted(conn.execute("SELECT file_id FROM bids").fetchall()) == [("new",), ("other",)]
+    conn.close()
+
+
+def transformation_row(transformation_id, target_id, transform_id, identity="no"):
+    return ("transformations", {"transformation_id": transformation_id, "identity": identity,
+                                "target_id": target_id, "transform_id": transform_id})
+
+
+def test_upsert_transformations_with_empty_id_uses_natural_key(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    assert insert_rows_batched([transformation_row(None, "target", "warp")], db_file, upsert=True) is not None
+
+    # the sidecar of a second image transformed with the same warp has an empty transformation_id as well
+    assert insert_rows_batched([transformation_row(None, "target", "warp", identity="yes"),
+                                transformation_row(None, "target", "other")], db_file, upsert=True) is not None
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT transformation_id, identity FROM transformations WHERE transform_id = 'warp'").fetchall() == [(1, "yes")]
+    assert conn.execute("SELECT COUNT(*) FROM transformations").fetchone() == (2,)
+    conn.close()
+
+
+def test_replaced_files_are_kept_if_the_insert_fails(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    file_path = "sub-01/ses-Pre/anat/sub-01_ses-Pre_acq-T1_T1w.nii.gz"
+    assert insert_rows_batched(file_rows("old", file_path), db_file, replace_files=True) is not None
+
+    # the files row of the new version is valid, the bids row is not
+    rows = file_rows("new", file_path)[:1] + [("bids", {"file_id": "new", "unknown_column": "x"})]
+    assert insert_rows_batched(rows, db_file, replace_files=True) is None
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT file_id FROM files").fetchall() == [("old",)]
+    assert conn.execute("SELECT file_id FROM bids").fetchall() == [("old",)]
+    conn.close()
+
+
+def test_insert_replaces_rehashed_file_with_replace_files(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    file_path = "sub-01/ses-Pre/anat/sub-01_ses-Pre_acq-T1_T1w.nii.gz"
+    assert insert_rows_batched(file_rows("old", file_path), db_file, replace_files=True) is not None
+    assert insert_rows_batched(file_rows("new", file_path), db_file, replace_files=True) is not None
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT file_id FROM files").fetchall() == [("new",)]
+    assert conn.execute("SELECT file_id FROM bids").fetchall() == [("new",)]
+    conn.close()
+
+
+def test_clear_change_log_keeps_the_changes_of_given_files(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    assert insert_rows_batched(file_rows("a", "sub-01/a.nii.gz") + file_rows("b", "sub-01/b.nii.gz"), db_file) is not None
+    changed_files, last_change_id = read_change_log(db_file)
+    assert sorted(file_id for file_id, _, _ in changed_files) == ["a", "b"]
+
+    clear_change_log(db_file, last_change_id, keep_file_ids=["b"])
+
+    changed_files, _ = read_change_log(db_file)
+    assert [(file_id, relative_sidecar_path) for file_id, _, relative_sidecar_path in changed_files] == [("b", None)]
+
+
+def test_session_without_autocommit_commits_when_it_ends(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    script = ("INSERT INTO labels (file_id, hemisphere, structure) VALUES ('a', 'L', 'x;y');"
+              "INSERT INTO labels (file_id, hemisphere, structure) VALUES ('b', 'R', 'z');")
+
+    with DatabaseSession(db_file, autocommit=False):
+        assert execute_sql_script(script, db_file) == "successfully."
+        assert insert_rows_batched(file_rows("new", "sub-01/new.nii.gz"), db_file) is not None
+        conn = sqlite3.connect(db_file)
+        assert conn.execute("SELECT COUNT(*) FROM labels").fetchone() == (0,)
+        conn.close()
+
+    conn = sqlite3.connect(db_file)
+    assert sorted(conn.execute("SELECT structure FROM labels").fetchall()) == [("x;y",), ("z",)]
+    assert conn.execute("SELECT file_id FROM files").fetchall() == [("new",)]
+    conn.close()
+
+
+def test_session_without_autocommit_rolls_back_a_failed_load(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+
+    with DatabaseSession(db_file, autocommit=False):
+        assert insert_rows_batched(file_rows("new", "sub-01/new.nii.gz"), db_file) is not None
+        assert isinstance(execute_sql_script("INSERT INTO unknown_table VALUES (1);", db_file), sqlite3.Error)
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM files").fetchone() == (0,)
+    conn.close()
+
+
+def test_insert_rows_batched_ignores_existing_rows(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    rows = [row for i in range(7) for row in file_rows(f"id{i}", f"sub-01/file{i}.nii.gz")]
+    # batches smaller than the number of rows
+    assert insert_rows_batched(rows, db_file, batch_size=3) == {"files": 7, "bids": 7}
+
+    changed = file_rows("id0", "sub-01/file0.nii.gz")
+    changed[1][1]["modality"] = "CT"
+    assert insert_rows_batched(changed, db_file) == {"files": 0, "bids": 0}
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT modality FROM bids WHERE file_id = 'id0'").fetchone() == ("MR",)
+    conn.close()
+
+
+def test_upsert_updates_only_changed_rows(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    rows = file_rows("a", "sub-01/a.nii.gz") + file_rows("b", "sub-01/b.nii.gz")
+    assert insert_rows_batched(rows, db_file, upsert=True) == {"files": 2, "bids": 2}
+
+    rows = file_rows("a", "sub-01/a.nii.gz") + file_rows("b", "sub-01/b.nii.gz")
+    rows[3][1]["modality"] = "CT"
+    assert insert_rows_batched(rows, db_file, upsert=True) == {"files": 0, "bids": 1}
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT file_id, modality FROM bids ORDER BY file_id").fetchall() == [("a", "MR"), ("b", "CT")]
+    conn.close()
@@ -0,0 +1,150 @@
+import errno
+import hashlib
+import os
+import sqlite3
+
+import pytest
+
+from PyUtilities import fileFunctions
+from PyUtilities.fileFunctions import copy_file, set_hash_cache, calculate_hash, iter_hashes, hash_files, evict_hash_cache, get_hash_cache_connection
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    # no strategy is known to be unsupported from other tests
+    monkeypatch.setattr(fileFunctions, "unsupported_strategies", {})
+    src = tmp_path / "src.nii.gz"
+    src.write_bytes(os.urandom(100_000))
+    os.utime(src, ns=(10**18, 10**18))
+    return src
+
+
+def failing_copy(error, calls=None):
+    def copy(src, dst):
+        if calls is not None:
+            calls.append(error)
+        raise OSError(error, os.strerror(error))
+    return copy
+
+
+def test_copy_file_falls_back_to_a_plain_copy(source, tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setitem(fileFunctions._copy_functions, "reflink", failing_copy(errno.EOPNOTSUPP, calls))
+    monkeypatch.setitem(fileFunctions._copy_functions, "copy_file_range", failing_copy(errno.EXDEV, calls))
+
+    for name in ("first.nii.gz", "second.nii.gz"):
+        dst = tmp_path / name
+        assert copy_file(str(source), str(dst)) == "copy"
+        assert dst.read_bytes() == source.read_bytes()
+        assert os.stat(dst).st_mtime_ns == 10**18
+    # the failed strategies are not tried again for the same devices
+    assert calls == [errno.EOPNOTSUPP, errno.EXDEV]
+
+
+def test_copy_file_hardlinks_only_immutable_sources(source, tmp_path, monkeypatch):
+    monkeypatch.setitem(fileFunctions._copy_functions, "reflink", failing_copy(errno.ENOTTY))
+
+    assert copy_file(str(source), str(tmp_path / "copy.nii.gz")) != "hardlink"
+    assert not os.path.samefile(source, tmp_path / "copy.nii.gz")
+    assert copy_file(str(source), str(tmp_path / "link.nii.gz"), immutable=True) == "hardlink"
+    assert os.path.samefile(source, tmp_path / "link.nii.gz")
+
+
+def test_copy_file_raises_other_errors(source, tmp_path, monkeypatch):
+    monkeypatch.setitem(fileFunctions._copy_functions, "reflink", failing_copy(errno.ENOSPC))
+
+    with pytest.raises(OSError) as excinfo:
+        copy_file(str(source), str(tmp_path / "copy.nii.gz"))
+    assert excinfo.value.errno == errno.ENOSPC
+
+
+@pytest.fixture
+def hash_cache(tmp_path):
+    cache_path = str(tmp_path / "hash_cache.db")
+    set_hash_cache(cache_path)
+    yield cache_path
+    set_hash_cache(None)
+
+
+def write_old_file(path, data, mtime_ns=10**18):
+    # files modified just before they are hashed are not cached
+    path.write_bytes(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def cached_hashes(cache_path):
+    conn = sqlite3.connect(cache_path)
+    hashes = [row[0] for row in conn.execute("SELECT hash FROM hash_cache ORDER BY hash")]
+    conn.close()
+    return hashes
+
+
+def test_hash_cache_is_keyed_by_the_file_attributes(hash_cache, tmp_path):
+    image = tmp_path / "image.nii.gz"
+    write_old_file(image, b"a" * 1000)
+    first_hash = calculate_hash(str(image))
+    assert cached_hashes(hash_cache) == [first_hash]
+
+    # same inode, size and mtime: the cached hash is used without reading the file
+    write_old_file(image, b"b" * 1000)
+    assert calculate_hash(str(image)) == first_hash
+
+    # a modified file is not found in the cache
+    write_old_file(image, b"b" * 1000, mtime_ns=10**18 + 1)
+    assert calculate_hash(str(image)) == hashlib.sha256(b"b" * 1000).hexdigest()
+
+
+def test_hash_cache_skips_recently_modified_files(hash_cache, tmp_path):
+    image = tmp_path / "image.nii.gz"
+    image.write_bytes(b"a" * 1000)
+
+    assert calculate_hash(str(image)) == hashlib.sha256(b"a" * 1000).hexdigest()
+    assert cached_hashes(hash_cache) == []
+
+
+def test_hash_cache_evicts_the_least_recently_used_hashes(hash_cache, tmp_path):
+    files = []
+    for i in range(4):
+        files.append(tmp_path / f"image{i}.nii.gz")
+        write_old_file(files[-1], bytes([i]) * 1000)
+    hashes = [calculate_hash(str(file)) for file in files]
+    conn = get_hash_cache_connection()
+    with conn:
+        for i, file_hash in enumerate(hashes):
+            conn.execute("UPDATE hash_cache SET last_used = ? WHERE hash = ?", ((i + 1) * 1000, file_hash))
+    # the first file was used most recently
+    with conn:
+        conn.execute("UPDATE hash_cache SET last_used = 10000 WHERE hash = ?", (hashes[0],))
+
+    # the cache is evicted when it is opened
+    set_hash_cache(hash_cache, max_entries=2)
+    assert evict_hash_cache(get_hash_cache_connection()) == 0
+    assert cached_hashes(hash_cache) == sorted([hashes[0], hashes[3]])
+
+
+def test_iter_hashes_closes_the_connections_of_the_pool(hash_cache, tmp_path):
+    files = []
+    for i in range(8):
+        files.append(tmp_path / f"image{i}.nii.gz")
+        write_old_file(files[-1], bytes([i]) * 1000)
+
+    hashes = list(iter_hashes([str(file) for file in files], num_workers=4))
+
+    assert hashes == [hashlib.sha256(bytes([i]) * 1000).hexdigest() for i in range(8)]
+    assert fileFunctions._connections == {}
+    assert cached_hashes(hash_cache) == sorted(hashes)
+
+
+@pytest.mark.parametrize("options", [{}, {"chunk_size": 4096}, {"use_mmap": True}, {"num_workers": 4}])
+def test_hash_files_gives_the_same_hashes_with_all_options(tmp_path, options):
+    files = []
+    for i, size in enumerate([0, 1, 4096, 100_000]):
+        files.append(str(tmp_path / f"image{i}.nii.gz"))
+        with open(files[-1], "wb") as f:
+            f.write(os.urandom(size))
+    expected = {}
+    for file in files:
+        with open(file, "rb") as f:
+            expected[file] = hashlib.md5(f.read()).hexdigest()
+
+    assert hash_files(files, "md5", **options) == expected
@@ -0,0 +1,45 @@
+import os
+
+from PyUtilities.manifestFunctions import diff_manifest
+
+
+def write_sidecar(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_diff_manifest_finds_new_modified_and_deleted_sidecars(tmp_path):
+    root = str(tmp_path)
+    unchanged = os.path.join(root, "sub-01", "anat", "sub-01_T1w_sidecar.json")
+    modified = os.path.join(root, "sub-01", "anat", "sub-01_T2w_sidecar.json")
+    deleted = os.path.join(root, "sub-02", "anat", "sub-02_T1w_sidecar.json")
+    for path in (unchanged, modified, deleted):
+        write_sidecar(path, "{}")
+    _, _, manifest = diff_manifest([unchanged, modified, deleted], root, {})
+    # the extraction adds the hash of the extracted sidecars
+    previous_manifest = {rel_path: dict(entry, hash="h") for rel_path, entry in manifest.items()}
+
+    write_sidecar(modified, '{"modality": "MR"}')
+    os.remove(deleted)
+    added = os.path.join(root, "sub-03", "anat", "sub-03_T1w_sidecar.json")
+    write_sidecar(added, "{}")
+    candidates, deleted_entries, manifest = diff_manifest([unchanged, modified, added], root, previous_manifest)
+
+    assert sorted(candidates) == sorted([modified, added])
+    assert list(deleted_entries) == [os.path.join("sub-02", "anat", "sub-02_T1w_sidecar.json")]
+    # unchanged sidecars keep the entry of the last run, changed ones get a new entry without hash
+    assert manifest[os.path.join("sub-01", "anat", "sub-01_T1w_sidecar.json")]["hash"] == "h"
+    assert "hash" not in manifest[os.path.join("sub-01", "anat", "sub-01_T2w_sidecar.json")]
+
+
+def test_diff_manifest_without_previous_manifest_extracts_everything(tmp_path):
+    root = str(tmp_path)
+    sidecar = os.path.join(root, "sub-01_T1w_sidecar.json")
+    write_sidecar(sidecar, "{}")
+
+    candidates, deleted_entries, manifest = diff_manifest([sidecar], root, {})
+
+    assert candidates == [sidecar]
+    assert deleted_entries == {}
+    assert list(manifest) == ["sub-01_T1w_sidecar.json"]
@@ -0,0 +1,78 @@
+import gzip
+import struct
+
+import pytest
+
+from PyUtilities.niftiHeaderFunctions import read_nifti_header, try_read_nifti_header
+
+
+def nifti1_header(endian="<"):
+    # offsets of the NIfTI-1 standard (nifti1.h)
+    header = bytearray(352)
+    struct.pack_into(endian + "i", header, 0, 348)
+    struct.pack_into(endian + "8h", header, 40, 3, 256, 256, 180, 1, 1, 1, 1)
+    struct.pack_into(endian + "h", header, 70, 16)
+    struct.pack_into(endian + "8f", header, 76, -1.0, 1.0, 1.0, 1.2, 0, 0, 0, 0)
+    struct.pack_into("80s", header, 148, b"T1 MPRAGE")
+    struct.pack_into(endian + "2h", header, 252, 1, 2)
+    struct.pack_into(endian + "6f", header, 256, 0.0, 0.5, 0.0, -90.0, 126.0, -72.0)
+    struct.pack_into(endian + "12f", header, 280, *range(12))
+    header[344:348] = b"n+1\0"
+    return bytes(header)
+
+
+def nifti2_header(endian="<"):
+    # offsets of the NIfTI-2 standard (nifti2.h)
+    header = bytearray(544)
+    struct.pack_into(endian + "i", header, 0, 540)
+    header[4:12] = b"n+2\0\r\n\032\n"
+    struct.pack_into(endian + "h", header, 12, 4)
+    struct.pack_into(endian + "8q", header, 16, 4, 64, 64, 30, 200, 1, 1, 1)
+    struct.pack_into(endian + "8d", header, 104, 1.0, 3.0, 3.0, 3.5, 2.0, 0, 0, 0)
+    struct.pack_into("80s", header, 240, b"bold")
+    struct.pack_into(endian + "2i", header, 344, 0, 4)
+    struct.pack_into(endian + "6d", header, 352, 0, 0, 0, 0, 0, 0)
+    struct.pack_into(endian + "12d", header, 400, *range(12))
+    return bytes(header)
+
+
+def write_image(path, header, compressed):
+    data = header + b"\0" * 1000
+    path.write_bytes(gzip.compress(data) if compressed else data)
+    return str(path)
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+@pytest.mark.parametrize("compressed", [False, True])
+def test_read_nifti1_header(tmp_path, endian, compressed):
+    image = write_image(tmp_path / ("T1w.nii.gz" if compressed else "T1w.nii"), nifti1_header(endian), compressed)
+
+    assert read_nifti_header(image) == {
+        "image_dimensions": "256x256x180", "voxel_sizes": "1x1x1.2", "image_datatype": "float32",
+        "qform_code": 1, "qform": "0 0.5 0 -90 126 -72 -1", "sform_code": 2,
+        "sform": "0 1 2 3 4 5 6 7 8 9 10 11", "image_description": "T1 MPRAGE"}
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+@pytest.mark.parametrize("compressed", [False, True])
+def test_read_nifti2_header(tmp_path, endian, compressed):
+    image = write_image(tmp_path / ("bold.nii.gz" if compressed else "bold.nii"), nifti2_header(endian), compressed)
+
+    header = read_nifti_header(image)
+
+    assert header["image_dimensions"] == "64x64x30x200"
+    assert header["voxel_sizes"] == "3x3x3.5x2"
+    assert header["image_datatype"] == "int16"
+    assert (header["qform_code"], header["sform_code"]) == (0, 4)
+    assert header["image_description"] == "bold"
+
+
+def test_read_nifti_header_of_other_files(tmp_path):
+    not_nifti = tmp_path / "image.nii"
+    not_nifti.write_bytes(b"\0" * 600)
+    truncated = tmp_path / "truncated.nii.gz"
+    truncated.write_bytes(gzip.compress(nifti1_header())[:40])
+
+    assert read_nifti_header(str(not_nifti)) is None
+    assert try_read_nifti_header(str(truncated)) is None
+    assert try_read_nifti_header(str(tmp_path / "missing.nii")) is None
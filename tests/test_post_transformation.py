@@ -0,0 +1,60 @@
+import os
+import shutil
+import sqlite3
+
+import importlib
+
+import pytest
+
+from PyUtilities.databaseFunctions import create_database, insert_rows_batched
+
+SCHEMA = os.path.join(os.path.dirname(__file__), os.pardir, "IMS_setup", "SQLite_setup", "sqlite_schema.sql")
+
+
+@pytest.fixture
+def post_transformation(tmp_path, monkeypatch):
+    # the module reads config.json from the working directory on import, the test sets CONFIG itself
+    (tmp_path / "config.json").write_text("null")
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("ETL.PostTransform.post_transformation")
+
+
+@pytest.fixture
+def subject_db(tmp_path):
+    db_file = str(tmp_path / "IMS.db")
+    create_database(db_file, SCHEMA)
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE subjects (subject_id INTEGER PRIMARY KEY, patient_id_acr TEXT)")
+    # "ST-01" and "st_01" have the same BIDS subject ID, the first subject is used
+    conn.executemany("INSERT INTO subjects (subject_id, patient_id_acr) VALUES (?, ?)",
+                     [(1, "ST-01"), (2, "st_01"), (3, " ab02 "), (4, None)])
+    conn.commit()
+    conn.close()
+    files = [("f1", "sub-ST01/ses-Pre/anat/sub-ST01_ses-Pre_T1w.nii.gz", None),
+             ("f2", "sub-AB02/anat/sub-AB02_T2w.nii.gz", "2"),
+             # no subject: a stale subject_id is removed
+             ("f3", "sub-XX99/anat/sub-XX99_T1w.nii.gz", "3"),
+             ("f4", "derivatives/sub-st01/sub-st01_label.nii.gz", None)]
+    insert_rows_batched((("files", {"file_id": file_id, "subject_id": subject_id, "file_path": file_path, "file_type": "raw-image"})
+                         for file_id, file_path, subject_id in files), db_file)
+    return db_file
+
+
+def read_subject_ids(db_file):
+    conn = sqlite3.connect(db_file)
+    subject_ids = conn.execute("SELECT file_id, subject_id FROM files ORDER BY file_id").fetchall()
+    conn.close()
+    return subject_ids
+
+
+def test_update_subject_ids_sql_matches_the_pandas_merge(post_transformation, subject_db, tmp_path, monkeypatch):
+    sql_db = str(tmp_path / "IMS_sql.db")
+    shutil.copy(subject_db, sql_db)
+
+    monkeypatch.setattr(post_transformation, "CONFIG", {"db_path": subject_db})
+    post_transformation.update_subject_ids()
+    monkeypatch.setattr(post_transformation, "CONFIG", {"db_path": sql_db})
+    post_transformation.update_subject_ids_sql()
+
+    assert read_subject_ids(subject_db) == [("f1", "1"), ("f2", "3"), ("f3", None), ("f4", "1")]
+    assert read_subject_ids(sql_db) == read_subject_ids(subject_db)
@@ -0,0 +1,17 @@
+from PyUtilities.read_write import write_ndjson, read_ndjson, index_ndjson, read_ndjson_record
+
+
+def test_ndjson_offset_index_reads_single_records(tmp_path):
+    fname = str(tmp_path / "extractedSideCarData.ndjson")
+    records = [{"sidecar": f"sub-{i:02d}/anat/sub-{i:02d}_T1w_sidecar.json", "sidecardata": {"comment": "é" * i}}
+               for i in range(20)]
+    written_index = {}
+    assert write_ndjson(fname, iter(records), written_index, "sidecar") == 20
+
+    # the index built while writing equals the index built from the file
+    index = index_ndjson(fname, "sidecar")
+    assert index == written_index
+    with open(fname, "rb") as file:
+        for record in reversed(records):
+            assert read_ndjson_record(file, index[record["sidecar"]]) == record
+    assert list(read_ndjson(fname)) == records
@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+from PyUtilities import utility_functions
+from PyUtilities.utility_functions import get_sidecar_path, compress_and_hash, compress_and_hash_if_changed, scan_files, copy_and_hash, copy_and_hash_if_changed
+
+
+def test_get_sidecar_path_keeps_dotted_directories():
+    assert get_sidecar_path("sub-01/ses-Pre/anat/sub-01_T1w.nii.gz") == "sub-01/ses-Pre/anat/sub-01_T1w_sidecar.json"
+    assert get_sidecar_path("sub-01/ses-1.5/anat/sub-01_T1w.nii") == "sub-01/ses-1.5/anat/sub-01_T1w_sidecar.json"
+    assert get_sidecar_path("derivatives/x.y/sub-01_T2star.mnc.gz") == "derivatives/x.y/sub-01_T2star_sidecar.json"
+
+
+def test_get_sidecar_path_prefers_relative_sidecar_path():
+    assert get_sidecar_path("sub-01/anat/sub-01_T1w.nii.gz", "sub-01/anat/sub-01_T1w.json") == "sub-01/anat/sub-01_T1w.json"
+    assert get_sidecar_path("sub-01/anat/sub-01_T1w.nii.gz", None) == "sub-01/anat/sub-01_T1w_sidecar.json"
+
+
+def write_image(path, data, mtime_ns=None):
+    with open(path, "wb") as f:
+        f.write(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_compress_and_hash_round_trips_through_gzip(tmp_path):
+    src, dst = str(tmp_path / "image.nii"), str(tmp_path / "image.nii.gz")
+    # several blocks, compressible and incompressible ones
+    data = os.urandom(300_000) + b"\0" * 300_000 + os.urandom(50_000)
+    write_image(src, data)
+
+    file_hash = compress_and_hash(src, dst, num_workers=3, block_size=64 * 1024)
+
+    with open(dst, "rb") as f:
+        compressed = f.read()
+    assert gzip.decompress(compressed) == data
+    assert file_hash == hashlib.sha256(compressed).hexdigest()
+    # no timestamp in the header: the same content gives the same file
+    assert compress_and_hash(src, str(tmp_path / "again.nii.gz"), num_workers=1, block_size=64 * 1024) == file_hash
+
+
+def test_compress_and_hash_if_changed_detects_an_edit_of_the_same_size(tmp_path):
+    src, dst = str(tmp_path / "image.nii"), str(tmp_path / "image.nii.gz")
+    data = os.urandom(100_000)
+    write_image(src, data, mtime_ns=10**18)
+    first_hash, compressed = compress_and_hash_if_changed(src, dst)
+    assert compressed
+    assert compress_and_hash_if_changed(src, dst) == (first_hash, False)
+
+    # same size and modification time, different content
+    write_image(src, data[:-1] + bytes([data[-1] ^ 1]), mtime_ns=10**18)
+    second_hash, compressed = compress_and_hash_if_changed(src, dst)
+    assert compressed and second_hash != first_hash
+    with open(dst, "rb") as f:
+        assert gzip.decompress(f.read()) == data[:-1] + bytes([data[-1] ^ 1])
+
+
+def test_failed_compression_keeps_the_previous_file(tmp_path, monkeypatch):
+    src, dst = str(tmp_path / "image.nii"), str(tmp_path / "image.nii.gz")
+    write_image(src, os.urandom(100_000))
+    file_hash, _ = compress_and_hash_if_changed(src, dst, block_size=16 * 1024)
+    write_image(src, os.urandom(100_000))
+
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(utility_functions, "_compress_block", fail)
+    with pytest.raises(OSError):
+        compress_and_hash_if_changed(src, dst, block_size=16 * 1024)
+
+    assert sorted(os.listdir(tmp_path)) == ["image.nii", "image.nii.gz"]
+    with open(dst, "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == file_hash
+
+
+def test_scan_files_finds_the_same_files_serially_and_in_parallel(tmp_path):
+    for subject in range(5):
+        for datatype in ("anat", "func"):
+            directory = tmp_path / f"sub-{subject:02d}" / datatype
+            directory.mkdir(parents=True)
+            (directory / f"sub-{subject:02d}_{datatype}_sidecar.json").write_text("{}")
+            (directory / f"sub-{subject:02d}_{datatype}.nii.gz").write_bytes(b"")
+    # symbolic links to directories are not followed, so the sidecars are not found twice
+    (tmp_path / "link").symlink_to(tmp_path / "sub-00", target_is_directory=True)
+
+    expected = sorted(Path(path) for path in tmp_path.glob("sub-*/*/*_sidecar.json"))
+    assert len(expected) == 10
+    assert scan_files(str(tmp_path), "_sidecar.json") == expected
+    assert scan_files(str(tmp_path), "_sidecar.json", num_workers=4) == expected
+
+
+@pytest.mark.parametrize("strategy", ["copy", "auto"])
+def test_copy_and_hash_copies_and_hashes_in_one_pass(tmp_path, strategy):
+    src, dst = str(tmp_path / "image.nii.gz"), str(tmp_path / "bids" / "image.nii.gz")
+    os.mkdir(tmp_path / "bids")
+    data = os.urandom(300_000)
+    write_image(src, data, mtime_ns=10**18)
+
+    assert copy_and_hash(src, dst, chunk_size=64 * 1024, strategy=strategy) == hashlib.sha256(data).hexdigest()
+    with open(dst, "rb") as f:
+        assert f.read() == data
+    assert os.stat(dst).st_mtime_ns == 10**18
+
+
+def test_copy_and_hash_if_changed_copies_only_changed_files(tmp_path):
+    src, dst = str(tmp_path / "image.nii.gz"), str(tmp_path / "copy.nii.gz")
+    write_image(src, b"a" * 1000, mtime_ns=10**18)
+    file_hash, copied = copy_and_hash_if_changed(src, dst)
+    assert copied
+    assert copy_and_hash_if_changed(src, dst) == (file_hash, False)
+
+    write_image(src, b"b" * 1000, mtime_ns=10**18)
+    assert copy_and_hash_if_changed(src, dst) == (hashlib.sha256(b"b" * 1000).hexdigest(), True)
@@ -1,7 +1,8 @@
-from ETL.Extract.extract import extract_sidecar_data
+from ETL.Extract.extract import extract_sidecar_data, CONFIG
 from ETL.Transform.transform import transform_sidecar_data
 from ETL.Load.load import load_sidecar_data, database_setup
 from ETL.PostTransform.post_transformation import update_transformation_id, backpropation
+from PyUtilities import commit_manifest
 
 import logging
 
@@ -25,8 +26,16 @@ def workflow_BIDS2SQLite():
     database_setup()
 
     # Load data
-    load_sidecar_data()
+    if not load_sidecar_data():
+        # the manifest is not committed, so the next incremental run extracts the same sidecars again
+        workflow_logger.error("Workflow failed, data could not be loaded.")
+        return False
+
+    # Remember the extracted sidecars for the next incremental run
+    if CONFIG.get('incremental_extraction', False):
+        commit_manifest(CONFIG['extraction_path'])
     workflow_logger.info("Workflow finished successfully.")
+    return True
 
 # Main program
 if __name__ == "__main__":
@@ -16,6 +16,7 @@ if __name__ == "__main__":
         9. Create the BIDS sidecar files
         10. Create the BIDS labels files
         11. Create the BIDS labels sidecar files
+    12. Store the files, bids and labels rows of all images in the database
     """
     NIFTI2BIDS()
     